@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
-from . import udb, providers, sack
+from . import udb, keys, merge, providers, sack
 
 from .udb import *
+from .keys import *
+from .merge import *
 from .sack.file import *
+from .sack.pfile import *
 from .providers.sack import *
 
-__all__ = udb.__all__ + sack.file.__all__ + providers.sack.__all__
+__all__ = udb.__all__ + keys.__all__ + merge.__all__ + sack.file.__all__ + sack.pfile.__all__ + providers.sack.__all__
 #------------------------------------------------------------------------------#
 # Load Tests Protocol                                                          #
 #------------------------------------------------------------------------------#
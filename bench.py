@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks
+
+Usage: python -m udb.bench [benchmark ...]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from .udb import uDB
+from .providers.sack import FLAG_COMPRESSION, FLAG_PREFIX, ZlibCodec
+
+#------------------------------------------------------------------------------#
+# Helpers                                                                      #
+#------------------------------------------------------------------------------#
+class Timer (object):
+    def __enter__ (self):
+        self.start = time.time ()
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        self.elapsed = time.time () - self.start
+        return False
+
+def fragmented_db (path, count):
+    """Create database with heavily fragmented allocator"""
+    keys = [str (index).encode () for index in range (count)]
+    with uDB (path, 'n', order = 32) as db:
+        for key in keys:
+            db [key] = key * random.randint (1, 8)
+        db.Flush ()
+        random.shuffle (keys)
+        for key in keys [:count >> 1]:
+            del db [key]
+
+#------------------------------------------------------------------------------#
+# Benchmarks                                                                   #
+#------------------------------------------------------------------------------#
+def bench_open (count = 1 << 16, repeat = 100):
+    """Read-only open and single lookup"""
+    directory = tempfile.mkdtemp ()
+    try:
+        path = os.path.join (directory, 'db')
+        fragmented_db (path, count)
+
+        with uDB (path, 'r') as db:
+            key = next (iter (db))
+        with Timer () as timer:
+            for index in range (repeat):
+                with uDB (path, 'r') as db:
+                    db [key]
+        print ('open (readonly): {:.3f}ms'.format (timer.elapsed * 1000 / repeat))
+
+        with Timer () as timer:
+            for index in range (repeat):
+                with uDB (path, 'r') as db:
+                    db.sack.alloc
+        print ('open (readonly, allocator): {:.3f}ms'.format (timer.elapsed * 1000 / repeat))
+    finally:
+        shutil.rmtree (directory)
+
+def bench_prefix (count = 1 << 16, repeat = 1 << 14):
+    """Leaf size and lookup cost of key compression modes"""
+    keys = ['tenant/{:04}/namespace/objects/{:08}'.format (index % 16, index).encode () for index in range (count)]
+    lookups = [random.choice (keys) for index in range (repeat)]
+
+    directory = tempfile.mkdtemp ()
+    try:
+        for name, flags in (('plain', 0), ('zlib', FLAG_COMPRESSION), ('prefix', FLAG_PREFIX),
+                            ('prefix+zlib', FLAG_PREFIX | FLAG_COMPRESSION)):
+            path = os.path.join (directory, name)
+            with uDB (path, 'n', flags = flags) as db:
+                db.AddMany ((key, b'value') for key in keys)
+
+            with uDB (path, 'r') as db:
+                # leafs size
+                leafs, size, capacity = 0, 0, 0
+                node = db.provider.Root ()
+                while not node.is_leaf:
+                    node = db.provider.DescToNode (node.children [0])
+                while node is not None:
+                    leafs += 1
+                    size += len (db.sack.Get (node.desc))
+                    capacity += 1 << (node.desc & 0xff)
+                    node = db.provider.DescToNode (node.next)
+
+            with uDB (path, 'r') as db:
+                with Timer () as cold:
+                    for key in lookups:
+                        db [key]
+                with Timer () as warm:
+                    for key in lookups:
+                        db [key]
+
+            print ('{:<12} bytes/leaf: {:>6} allocated/leaf: {:>6} lookup (cold): {:.2f}us lookup (warm): {:.2f}us'
+                .format (name, size // leafs, capacity // leafs, cold.elapsed * 1e6 / repeat,
+                    warm.elapsed * 1e6 / repeat))
+    finally:
+        shutil.rmtree (directory)
+
+def bench_codec (count = 1 << 15, order = 32):
+    """Compression ratio and throughput of codecs (small leafs)"""
+    items = [('user/{:08}'.format (index).encode (),
+        '{{"id": {}, "name": "user{}", "active": {}, "score": {}}}'.format (index, index,
+            'true' if index % 3 else 'false', random.randint (0, 1000)).encode ()) for index in range (count)]
+    raw = sum (len (key) + len (value) for key, value in items)
+
+    directory = tempfile.mkdtemp ()
+    try:
+        for name, codec in (('none', None), ('zlib:1', ZlibCodec (1)), ('zlib:6', ZlibCodec (6)),
+                            ('zlib:9', ZlibCodec (9)), ('lzma', 'lzma'), ('bz2', 'bz2'), ('zdict', 'zdict')):
+            path = os.path.join (directory, name)
+            with Timer () as write:
+                with uDB (path, 'n', order = order, codec = codec) as db:
+                    db.AddMany (items)
+
+            with uDB (path, 'r') as db:
+                with Timer () as read:
+                    for key, value in db.items ():
+                        pass
+
+                # leafs size
+                size = 0
+                node = db.provider.Root ()
+                while not node.is_leaf:
+                    node = db.provider.DescToNode (node.children [0])
+                while node is not None:
+                    size += len (db.sack.Get (node.desc))
+                    node = db.provider.DescToNode (node.next)
+
+            print ('{:<8} ratio: {:5.2f} write: {:7.2f}MB/s read: {:7.2f}MB/s'.format (name, float (raw) / size,
+                raw / write.elapsed / (1 << 20), raw / read.elapsed / (1 << 20)))
+    finally:
+        shutil.rmtree (directory)
+
+def bench_append (count = 1 << 17, batch = 1 << 8):
+    """Leafs fill factor and insert throughput of sequential and random inserts"""
+    keys = ['series/{:012}'.format (index).encode () for index in range (count)]
+    orders = (('ascending', keys), ('descending', keys [::-1]), ('random', random.sample (keys, count)))
+
+    directory = tempfile.mkdtemp ()
+    try:
+        for name, keys in orders:
+            for mode in ('add', 'batch'):
+                path = os.path.join (directory, '{}-{}'.format (name, mode))
+                with Timer () as write:
+                    with uDB (path, 'n') as db:
+                        if mode == 'add':
+                            for key in keys:
+                                db [key] = b'value'
+                        else:
+                            for index in range (0, count, batch):
+                                db.AddMany ((key, b'value') for key in keys [index:index + batch])
+
+                with uDB (path, 'r') as db:
+                    leafs = 0
+                    node = db.provider.Root ()
+                    while not node.is_leaf:
+                        node = db.provider.DescToNode (node.children [0])
+                    while node is not None:
+                        leafs += 1
+                        node = db.provider.DescToNode (node.next)
+                    fill = float (count) / (leafs * (db.provider.Order () - 1))
+
+                print ('{:<10} {:<5} leafs: {:>5} fill: {:.2f} insert: {:8.0f} keys/s'.format (name, mode, leafs,
+                    fill, count / write.elapsed))
+    finally:
+        shutil.rmtree (directory)
+
+#------------------------------------------------------------------------------#
+# Main                                                                         #
+#------------------------------------------------------------------------------#
+benchmarks = {
+    'append' : bench_append,
+    'codec'  : bench_codec,
+    'open'   : bench_open,
+    'prefix' : bench_prefix,
+}
+
+def main (argv):
+    for name in (argv or sorted (benchmarks)):
+        print ('[{}]'.format (name))
+        benchmarks [name] ()
+
+if __name__ == '__main__':
+    main (sys.argv [1:])
+# vim: nu ft=python columns=120 :
@@ -1,14 +1,23 @@
 # -*- coding: utf-8 -*-
 import sys
+from array       import array
 from bisect      import bisect, bisect_left
 from collections import MutableMapping
+from itertools   import islice
 from operator    import itemgetter
 
+from .utils import BytesPrefixSize, ArrayUInt64
+from .merge import MergeOperator
+
 if sys.version_info [0] < 3:
     from itertools import imap as map
 
 __all__ = ('BPTree', 'BPTreeNode', 'BPTreeLeaf')
 null = object ()
+default_bulk_fill = .9
+default_append_fill = .9 # fill of nodes left behind by appends at the edge of the tree
+
+split_left, split_right = 1, 2 # append directions
 
 #------------------------------------------------------------------------------#
 # B+Tree                                                                       #
@@ -38,6 +47,55 @@ class BPTree (MutableMapping):
 
         return node.children [index]
 
+    #--------------------------------------------------------------------------#
+    # Get Many                                                                 #
+    #--------------------------------------------------------------------------#
+    def GetMany (self, keys, default = None):
+        """Get values for multiple keys
+
+        Keys are resolved in sorted order reusing the path from the root while
+        consecutive keys stay inside the same nodes, so every node is visited
+        at most once per call.
+
+        keys:    iterable of keys
+        default: value for missing keys
+        returns: list of values in the order of keys
+        """
+        keys = keys if isinstance (keys, list) else list (keys)
+        values = [default] * len (keys)
+
+        # provider
+        desc2node = self.provider.DescToNode
+        depth = self.provider.Depth ()
+
+        # path of (node, high) where high is exclusive upper bound of node's keys
+        path = [(self.provider.Root (), None)]
+        for position in sorted (range (len (keys)), key = keys.__getitem__):
+            key = keys [position]
+
+            # ascend until key is inside node bounds
+            while len (path) > 1:
+                high = path [-1][1]
+                if high is None or key < high:
+                    break
+                path.pop ()
+
+            # descend to leaf
+            node, high = path [-1]
+            while len (path) < depth:
+                index = bisect (node.keys, key)
+                if index < len (node.keys):
+                    high = node.keys [index]
+                node = desc2node (node.children [index])
+                path.append ((node, high))
+
+            # check key
+            index = bisect_left (node.keys, key)
+            if index < len (node.keys) and key == node.keys [index]:
+                values [position] = node.children [index]
+
+        return values
+
     #--------------------------------------------------------------------------#
     # Get Cursor                                                               #
     #--------------------------------------------------------------------------#
@@ -52,18 +110,86 @@ class BPTree (MutableMapping):
     #--------------------------------------------------------------------------#
     # Get Range                                                                #
     #--------------------------------------------------------------------------#
-    def GetRange (self, low = None, high = None):
+    def GetRange (self, low = None, high = None, offset = None, limit = None, reverse = False, inclusive = None):
+        """Items with keys in range
+
+        offset:    number of leading items of the range to skip
+        limit:     maximum number of returned items
+        reverse:   iterate from high to low bound (following prev links of leafs)
+        inclusive: (low inclusive, high inclusive) bounds flags, both bounds are inclusive by default
+        returns: iterator of (key, value) pairs
+
+        Offset is resolved in O(depth) if tree maintains subtree counts,
+        otherwise skipped items are iterated. Leafs are loaded lazily, so leafs
+        past the limit are never loaded.
+        """
+        inclusive = (True, True) if inclusive is None else inclusive
+        if offset and not self.provider.Counted ():
+            return islice (self.get_range (low, high, None, reverse, inclusive), offset,
+                None if limit is None else offset + limit)
+        items = self.get_range (low, high, offset, reverse, inclusive)
+        return items if limit is None else islice (items, limit)
+
+    def get_range (self, low, high, offset, reverse, inclusive):
+        low_inclusive, high_inclusive = inclusive
+
         # validate range
-        if low is not None and high is not None and low >= high:
+        if low is not None and high is not None and (low > high or
+            (low == high and not (low_inclusive and high_inclusive))):
+            return
+        if not self.provider.Size ():
             return
 
-        # find first leaf
+        # provider
         desc2node = self.provider.DescToNode
+
+        if reverse:
+            # find last leaf (index is next to the first item)
+            node = self.provider.Root ()
+            if offset:
+                position = ((self.provider.Size () if high is None else
+                    self.rank (high, bisect if high_inclusive else bisect_left)) - offset - 1)
+                if position < 0:
+                    return
+                node, index = self.select (position)
+                index += 1
+            elif high is not None:
+                for depth in range (self.provider.Depth () - 1):
+                    node = desc2node (node.children [bisect (node.keys, high)])
+                index = (bisect if high_inclusive else bisect_left) (node.keys, high)
+            else:
+                for depth in range (self.provider.Depth () - 1):
+                    node = desc2node (node.children [-1])
+                index = len (node.keys)
+
+            # iterate over whole leafs
+            while low is None or node.keys [0] > low:
+                for index in range (index - 1, -1, -1):
+                    yield node.keys [index], node.children [index]
+                node = desc2node (node.prev)
+                if node is None:
+                    return
+                index = len (node.keys)
+
+            # iterate over last leaf
+            for index in range (index - 1, -1, -1):
+                key, value = node.keys [index], node.children [index]
+                if key < low or (key == low and not low_inclusive):
+                    return
+                yield key, value
+            return
+
+        # find first leaf
         node = self.provider.Root ()
-        if low is not None:
+        if offset:
+            position = offset + (0 if low is None else self.rank (low, bisect_left if low_inclusive else bisect))
+            if position >= self.provider.Size ():
+                return
+            node, index = self.select (position)
+        elif low is not None:
             for depth in range (self.provider.Depth () - 1):
                 node = desc2node (node.children [bisect (node.keys, low)])
-            index = bisect_left (node.keys, low)
+            index = (bisect_left if low_inclusive else bisect) (node.keys, low)
             if index >= len (node.keys):
                 next = desc2node (node.next)
                 if next is None:
@@ -75,7 +201,7 @@ class BPTree (MutableMapping):
             index = 0
 
         # iterate over whole leafs
-        while not high or node.keys [-1] < high:
+        while high is None or node.keys [-1] < high:
             for index in range (index, len (node.keys)):
                 yield node.keys [index], node.children [index]
             node = desc2node (node.next)
@@ -86,53 +212,150 @@ class BPTree (MutableMapping):
         # iterate over last leaf
         for index in range (index, len (node.keys)):
             key, value = node.keys [index], node.children [index]
-            if key > high:
+            if key > high or (key == high and not high_inclusive):
                 return
             yield key, value
 
+    #--------------------------------------------------------------------------#
+    # Order Statistics                                                         #
+    #--------------------------------------------------------------------------#
+    def Rank (self, key):
+        """Number of keys less than key (requires subtree counts)"""
+        self.counts_require ()
+        return self.rank (key, bisect_left)
+
+    def Select (self, index):
+        """Item at index in keys order (requires subtree counts)
+
+        index: position of item, negative index counts from the end
+        returns: (key, value)
+        """
+        self.counts_require ()
+        leaf, index = self.select (index)
+        return leaf.keys [index], leaf.children [index]
+
+    def CountRange (self, low = None, high = None):
+        """Number of items in range (both bounds are inclusive, requires subtree counts)"""
+        self.counts_require ()
+        if low is not None and high is not None and low > high:
+            return 0
+        return ((self.provider.Size () if high is None else self.rank (high, bisect)) -
+                (0 if low is None else self.rank (low, bisect_left)))
+
+    def counts_require (self):
+        if not self.provider.Counted ():
+            raise ValueError ('Tree does not maintain subtree counts')
+
+    def rank (self, key, leaf_bisect):
+        """Number of keys less than key (bisect_left) or not greater than key (bisect)"""
+        desc2node = self.provider.DescToNode
+
+        node, rank = self.provider.Root (), 0
+        for depth in range (self.provider.Depth () - 1):
+            index = bisect (node.keys, key)
+            rank += sum (node.counts [:index])
+            node = desc2node (node.children [index])
+
+        return rank + leaf_bisect (node.keys, key)
+
+    def select (self, index):
+        """Find item by its index
+
+        returns: (leaf, index inside leaf)
+        """
+        desc2node = self.provider.DescToNode
+
+        size = self.provider.Size ()
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError ('Index out of range')
+
+        node = self.provider.Root ()
+        for depth in range (self.provider.Depth () - 1):
+            for child_index, count in enumerate (node.counts):
+                if index < count:
+                    break
+                index -= count
+            node = desc2node (node.children [child_index])
+
+        return node, index
+
     #--------------------------------------------------------------------------#
     # Add                                                                      #
     #--------------------------------------------------------------------------#
     def Add (self, key, value):
-        # provider
-        order = self.provider.Order ()
-        dirty = self.provider.Dirty
+        path = self.path_find (key)
+
+        # check if value is updated
+        index, node = path [-1][0], path [-1][2]
+        if index < len (node.keys) and key == node.keys [index]:
+            node.children [index] = value
+            self.provider.Dirty (node)
+            return
+
+        self.path_insert (path, key, value)
+
+    def path_find (self, key):
+        """Find path to the leaf where key belongs
+
+        returns: [(key index, child index, node)] from the root to the leaf
+        """
         desc2node = self.provider.DescToNode
-        node2desc = self.provider.NodeToDesc
 
-        # find path
         node, path = self.provider.Root (), []
         for depth in range (self.provider.Depth () - 1):
             index = bisect (node.keys, key)
             path.append ((index, index + 1, node))
             node = desc2node (node.children [index])
 
-        # check if value is updated
         index = bisect_left (node.keys, key)
-        if index < len (node.keys) and key == node.keys [index]:
-            node.children [index] = value
-            dirty (node)
-            return
         path.append ((index, index, node))
+        return path
+
+    def path_insert (self, path, key, value):
+        """Insert missing key at the end of the path found by path_find"""
+        # provider
+        order = self.provider.Order ()
+        counted = self.provider.Counted ()
+        dirty = self.provider.Dirty
+        desc2node = self.provider.DescToNode
+        node2desc = self.provider.NodeToDesc
 
         # size += 1
         self.provider.Size (self.provider.Size () + 1)
+        if counted:
+            for node_index, child_index, parent in path [:-1]:
+                parent.counts [node_index] += 1
+                dirty (parent)
+
+        # keys appended at the edge of the tree (ancestors of the edge leaf are edge nodes as well)
+        key_index, child_index, leaf = path [-1]
+        if not leaf.next and key_index == len (leaf.keys):
+            append = split_right
+        elif not leaf.prev and key_index == 0:
+            append = split_left
+        else:
+            append = 0
 
-        # update tree
-        sibling = None
+        # update tree (child is split node and sibling is its new right sibling)
+        child, sibling = None, None
         while path:
             key_index, child_index, node = path.pop ()
 
             # add new key
             node.keys.insert (key_index, key)
             node.children.insert (child_index, value)
+            if sibling is not None and counted:
+                node.counts [key_index] = node_count (child)
+                node.counts.insert (child_index, node_count (sibling))
             dirty (node)
 
             if len (node.keys) < order:
                 return
 
             # node is full so we need to split it
-            center = len (node.children) >> 1
+            center = split_bounds (len (node.children), order - 1 if node.is_leaf else order, append) [0]
             keys, children = node.Chop (center)
             if node.is_leaf:
                 # create right sibling
@@ -147,21 +370,374 @@ class BPTree (MutableMapping):
                     dirty (node_next)
 
                 # update key
-                key, value = sibling.keys [0], sibling_desc
+                key, value = separator (node.keys [-1], sibling.keys [0]), sibling_desc
 
             else:
                 # create right sibling
                 sibling = self.provider.NodeCreate (keys, children, False)
+                if counted:
+                    sibling.counts, node.counts = node.counts [center:], node.counts [:center]
 
                 # update key
                 key, value = node.keys.pop (), node2desc (sibling)
 
+            child = node
             dirty (sibling)
 
         # create new root
+        root = self.provider.NodeCreate ([key], [node2desc (child), node2desc (sibling)], False)
+        if counted:
+            root.counts = array (ArrayUInt64, (node_count (child), node_count (sibling)))
         self.provider.Depth (self.provider.Depth () + 1) # depth += 1
-        self.provider.Root (self.provider.NodeCreate ([key],
-            [node2desc (self.provider.Root ()), node2desc (sibling)], False))
+        self.provider.Root (root)
+
+    #--------------------------------------------------------------------------#
+    # Update                                                                   #
+    #--------------------------------------------------------------------------#
+    # Read-modify-write operations, value is read and written within a single
+    # descent from the root.
+
+    def Update (self, key, function, default = null):
+        """Replace value with function (value)
+
+        default: value passed to function if key is missing (KeyError if not set)
+        returns: new value
+        """
+        def update (value):
+            if value is null:
+                if default is null:
+                    raise KeyError (key)
+                value = default
+            return function (value)
+        return self.update (key, update) [1]
+
+    def SetDefault (self, key, default = None):
+        """Add default if key is missing
+
+        returns: value of the key
+        """
+        value, value_new = self.update (key, lambda value: default if value is null else null)
+        return value if value_new is null else value_new
+
+    def CompareAndSet (self, key, expected, value):
+        """Set value if current value is equal to expected
+
+        expected: expected value, None if key is expected to be missing
+        returns: True if value has been set
+        """
+        def compare (current):
+            if (expected is None and current is null) or (current is not null and current == expected):
+                return value
+            return null
+        return self.update (key, compare) [1] is not null
+
+    def Merge (self, key, operand, operator):
+        """Merge operand into value
+
+        operator: merge operator or its registered name (see merge module)
+        returns: new value
+        """
+        merge = MergeOperator (operator)
+        return self.update (key, lambda value: merge (None if value is null else value, operand)) [1]
+
+    def update (self, key, function):
+        """Update value with function
+
+        function: called with current value (null if key is missing), returns
+                  new value or null to keep the key unchanged
+        returns: (value, new value)
+        """
+        path = self.path_find (key)
+
+        index, node = path [-1][0], path [-1][2]
+        if index < len (node.keys) and key == node.keys [index]:
+            value = node.children [index]
+            value_new = function (value)
+            if value_new is not null:
+                node.children [index] = value_new
+                self.provider.Dirty (node)
+            return value, value_new
+
+        value_new = function (null)
+        if value_new is not null:
+            self.path_insert (path, key, value_new)
+        return null, value_new
+
+    #--------------------------------------------------------------------------#
+    # Add Many                                                                 #
+    #--------------------------------------------------------------------------#
+    def AddMany (self, items):
+        """Add multiple items
+
+        Items are sorted and applied in a single pass over the tree. All keys
+        landing in the same node are inserted together, so each touched node is
+        marked dirty and split (possibly into several siblings) only once.
+
+        items: iterable of (key, value) pairs or mapping
+        returns: number of added (not updated) items
+        """
+        # sort items, last value wins for duplicate keys
+        items_unique = []
+        for item in sorted (items.items () if hasattr (items, 'items') else items, key = itemgetter (0)):
+            if items_unique and items_unique [-1][0] == item [0]:
+                items_unique [-1] = item
+            else:
+                items_unique.append (item)
+        if not items_unique:
+            return 0
+
+        # provider
+        node2desc = self.provider.NodeToDesc
+
+        # update tree
+        root = self.provider.Root ()
+        count, siblings = self.add_many (root, items_unique, self.provider.Depth (), split_left | split_right)
+        self.provider.Size (self.provider.Size () + count)
+
+        # create new roots
+        while siblings:
+            children = [root] + [sibling for key, sibling in siblings]
+            root = self.provider.NodeCreate ([key for key, sibling in siblings],
+                [node2desc (child) for child in children], False)
+            if self.provider.Counted ():
+                root.counts = array (ArrayUInt64, (node_count (child) for child in children))
+            self.provider.Depth (self.provider.Depth () + 1) # depth += 1
+            self.provider.Root (root)
+            siblings = self.split_many (root)
+
+        return count
+
+    def add_many (self, node, items, depth, edge):
+        """Add sorted unique items to sub-tree
+
+        edge: append directions in which sub-tree is at the edge of the tree
+        returns: (added items count, [(separator key, new sibling)])
+        """
+        dirty = self.provider.Dirty
+
+        if depth <= 1:
+            # leaf
+            append = 0
+            if node.keys:
+                if not node.next and items [0][0] > node.keys [-1]:
+                    append = split_right
+                elif not node.prev and items [-1][0] < node.keys [0]:
+                    append = split_left
+
+            count, lower = 0, 0
+            for key, value in items:
+                index = bisect_left (node.keys, key, lower)
+                if index < len (node.keys) and key == node.keys [index]:
+                    node.children [index] = value
+                else:
+                    node.keys.insert (index, key)
+                    node.children.insert (index, value)
+                    count += 1
+                lower = index + 1
+            dirty (node)
+
+            return count, self.split_many (node, append)
+
+        # group items by child
+        desc2node, node2desc = self.provider.DescToNode, self.provider.NodeToDesc
+        counted = self.provider.Counted ()
+        count, begin, updates = 0, 0, []
+        while begin < len (items):
+            index = bisect (node.keys, items [begin][0])
+            if index < len (node.keys):
+                end, high = begin + 1, node.keys [index]
+                while end < len (items) and items [end][0] < high:
+                    end += 1
+            else:
+                end = len (items)
+
+            child = desc2node (node.children [index])
+            child_edge = ((edge & split_left if index == 0 else 0) |
+                          (edge & split_right if index == len (node.keys) else 0))
+            child_count, siblings = self.add_many (child, items [begin:end], depth - 1, child_edge)
+            if siblings:
+                updates.append ((index, child, siblings))
+            if counted:
+                node.counts [index] += child_count
+            count += child_count
+            begin = end
+
+        if not updates:
+            if counted and count:
+                dirty (node)
+            return count, []
+
+        # only edge child has been split
+        append = 0
+        if len (updates) == 1:
+            if edge & split_right and updates [0][0] == len (node.keys):
+                append = split_right
+            elif edge & split_left and updates [0][0] == 0:
+                append = split_left
+
+        # insert new siblings (in reversed order to keep indices valid)
+        for index, child, siblings in reversed (updates):
+            if counted:
+                node.counts [index] = node_count (child)
+            for offset, (key, sibling) in enumerate (siblings):
+                node.keys.insert (index + offset, key)
+                node.children.insert (index + offset + 1, node2desc (sibling))
+                if counted:
+                    node.counts.insert (index + offset + 1, node_count (sibling))
+        dirty (node)
+
+        return count, self.split_many (node, append)
+
+    def split_many (self, node, append = 0):
+        """Split overflowed node into as many siblings as needed
+
+        append: append direction if keys were appended at the edge of the tree
+        returns: [(separator key, new sibling)]
+        """
+        # provider
+        order = self.provider.Order ()
+        dirty = self.provider.Dirty
+        desc2node = self.provider.DescToNode
+        node2desc = self.provider.NodeToDesc
+
+        if len (node.keys) < order:
+            return []
+
+        bounds = split_bounds (len (node.children), order - 1 if node.is_leaf else order, append)
+
+        # chop once and slice chopped tail into siblings
+        offset = bounds [0]
+        keys, children = node.Chop (offset)
+        if node.counts is not None:
+            counts, node.counts = node.counts [offset:], node.counts [:offset]
+        key = node.keys [-1] if node.is_leaf else node.keys.pop ()
+
+        siblings = []
+        for begin, end in zip (bounds, bounds [1:] + [offset + len (children)]):
+            begin, end = begin - offset, end - offset
+            if node.is_leaf:
+                sibling = self.provider.NodeCreate (keys [begin:end], children [begin:end], True)
+                siblings.append ((separator (key, sibling.keys [0]), sibling))
+                key = sibling.keys [-1]
+            else:
+                # last key of internal chunk separates it from the next one
+                sibling = self.provider.NodeCreate (keys [begin:end - 1], children [begin:end], False)
+                siblings.append ((key, sibling))
+                key = keys [end - 1] if end <= len (keys) else None
+            if node.counts is not None:
+                sibling.counts = counts [begin:end]
+            dirty (sibling)
+
+        if node.is_leaf:
+            # keep leafs linked
+            node_next_desc, prev = node.next, node
+            for key, sibling in siblings:
+                prev.next, sibling.prev = node2desc (sibling), node2desc (prev)
+                prev = sibling
+            prev.next = node_next_desc
+            node_next = desc2node (node_next_desc)
+            if node_next:
+                node_next.prev = node2desc (prev)
+                dirty (node_next)
+        dirty (node)
+
+        return siblings
+
+    #--------------------------------------------------------------------------#
+    # Bulk Load                                                                #
+    #--------------------------------------------------------------------------#
+    def BulkLoad (self, items, fill = None):
+        """Build tree bottom-up from sorted items
+
+        Items are consumed in a single pass and nodes are written as soon as
+        they are complete (see Provider.NodeWrite), leaf is written once its
+        successor has been reserved, so links between leafs are final. Only
+        (separator, descriptor, count) entries of the level being built are
+        kept in memory.
+
+        items: iterable of (key, value) pairs sorted by unique keys
+        fill:  nodes fill factor in range (0, 1] (default 0.9)
+        returns: number of loaded items
+        """
+        # provider
+        provider = self.provider
+        order = provider.Order ()
+        half_order = order >> 1
+        node2desc = provider.NodeToDesc
+        reserve, write = provider.NodeReserve, provider.NodeWrite
+
+        if provider.Size ():
+            raise ValueError ('Bulk load requires empty tree')
+        fill = default_bulk_fill if fill is None else fill
+        if not 0 < fill <= 1:
+            raise ValueError ('Fill factor must be in range (0, 1]')
+
+        # capacities (leaf is measured in keys, node in children)
+        leaf_capacity = min (order - 1, max (half_order, 1, int ((order - 1) * fill)))
+        node_capacity = min (order, max (half_order + 1, 2, int (order * fill)))
+
+        def sorted_items ():
+            prev_key = null
+            for key, value in items:
+                if prev_key is not null and not prev_key < key:
+                    raise ValueError ('Items must be sorted by unique keys')
+                prev_key = key
+                yield key, value
+
+        #----------------------------------------------------------------------#
+        # Leafs                                                                #
+        #----------------------------------------------------------------------#
+        level, size, leaf_prev = [], 0, None # [(separator key, descriptor, count)]
+        try:
+            for keys, values in bulk_chunks (sorted_items (), leaf_capacity, half_order, order - 1):
+                leaf = provider.NodeCreate (keys, values, True)
+                reserve (leaf)
+                if leaf_prev is not None:
+                    # keep leafs linked
+                    leaf_prev.next, leaf.prev = node2desc (leaf), node2desc (leaf_prev)
+                    write (leaf_prev)
+                level.append ((keys [0] if leaf_prev is None else separator (leaf_prev.keys [-1], keys [0]),
+                    node2desc (leaf), len (keys)))
+                size += len (keys)
+                leaf_prev = leaf
+        except Exception:
+            for key, desc, count in level:
+                provider.ReleaseTree (desc, 1)
+            raise
+
+        if not level:
+            return 0
+        if len (level) > 1:
+            write (leaf_prev)
+
+        #----------------------------------------------------------------------#
+        # Nodes                                                                #
+        #----------------------------------------------------------------------#
+        depth = 1
+        while len (level) > 1:
+            level_next, node_prev = [], None
+            for keys, children in bulk_chunks (((key, (desc, count)) for key, desc, count in level),
+                node_capacity, half_order + 1, order):
+                node = provider.NodeCreate (keys [1:], [desc for desc, count in children], False)
+                if provider.Counted ():
+                    node.counts = array (ArrayUInt64, (count for desc, count in children))
+                reserve (node)
+                if node_prev is not None:
+                    write (node_prev)
+                level_next.append ((keys [0], node2desc (node), sum (count for desc, count in children)))
+                node_prev = node
+            if len (level_next) > 1:
+                write (node_prev)
+            level = level_next
+            depth += 1
+
+        # replace empty root (new root has not been written)
+        provider.Release (provider.Root ())
+        provider.Root (provider.DescToNode (level [0][1]))
+        provider.Depth (depth)
+        provider.Size (size)
+
+        return size
 
     #--------------------------------------------------------------------------#
     # Pop                                                                      #
@@ -169,6 +745,7 @@ class BPTree (MutableMapping):
     def Pop (self, key, default = null):
         # provider
         half_order = self.provider.Order () >> 1
+        counted = self.provider.Counted ()
         dirty = self.provider.Dirty
         desc2node = self.provider.DescToNode
 
@@ -190,6 +767,10 @@ class BPTree (MutableMapping):
 
         # size -= 1
         self.provider.Size (self.provider.Size () - 1)
+        if counted:
+            for child, node_index, parent in path:
+                parent.counts [node_index] -= 1
+                dirty (parent)
 
         # update tree
         while path:
@@ -198,6 +779,8 @@ class BPTree (MutableMapping):
             # remove scheduled (key | child)
             del node.keys [key_index]
             del node.children [child_index]
+            if node.counts is not None:
+                del node.counts [child_index]
 
             if len (node.keys) >= half_order:
                 dirty (node)
@@ -211,13 +794,24 @@ class BPTree (MutableMapping):
                 # has left sibling
                 left = desc2node (parent.children [node_index - 1])
                 if len (left.keys) > half_order: # borrow from left sibling
-                    # copy correct key to node
-                    node.keys.insert (0, left.keys [-1] if node.is_leaf
-                        else parent.keys [node_index - 1])
-                    # move left key to parent
-                    parent.keys [node_index - 1] = left.keys.pop ()
+                    if node.is_leaf:
+                        # move left key to node
+                        node.keys.insert (0, left.keys.pop ())
+                        # update parent key
+                        parent.keys [node_index - 1] = separator (left.keys [-1], node.keys [0])
+                    else:
+                        # copy correct key to node
+                        node.keys.insert (0, parent.keys [node_index - 1])
+                        # move left key to parent
+                        parent.keys [node_index - 1] = left.keys.pop ()
                     # move left child to node
                     node.children.insert (0, left.children.pop ())
+                    if counted:
+                        moved = 1 if node.is_leaf else left.counts [-1]
+                        if not node.is_leaf:
+                            node.counts.insert (0, left.counts.pop ())
+                        parent.counts [node_index - 1] -= moved
+                        parent.counts [node_index] += moved
 
                     dirty (node), dirty (left), dirty (parent)
                     return value
@@ -229,8 +823,8 @@ class BPTree (MutableMapping):
                     if node.is_leaf:
                         # move right key to node
                         node.keys.append (right.keys.pop (0))
-                        # copy next right key to parent
-                        parent.keys [node_index] = right.keys [0]
+                        # update parent key
+                        parent.keys [node_index] = separator (node.keys [-1], right.keys [0])
                     else:
                         # copy correct key to node
                         node.keys.append (parent.keys [node_index])
@@ -238,6 +832,12 @@ class BPTree (MutableMapping):
                         parent.keys [node_index] = right.keys.pop (0)
                     # move right child to node
                     node.children.append (right.children.pop (0))
+                    if counted:
+                        moved = 1 if node.is_leaf else right.counts [0]
+                        if not node.is_leaf:
+                            node.counts.append (right.counts.pop (0))
+                        parent.counts [node_index + 1] -= moved
+                        parent.counts [node_index] += moved
 
                     dirty (node), dirty (right), dirty (parent)
                     return value
@@ -262,6 +862,10 @@ class BPTree (MutableMapping):
             # copy node's (keys | children)
             dst.keys.extend (src.keys)
             dst.children.extend (src.children)
+            if counted:
+                if not node.is_leaf:
+                    dst.counts.extend (src.counts)
+                parent.counts [child_index - 1] += parent.counts [child_index]
 
             # mark nodes
             self.provider.Release (src)
@@ -276,6 +880,8 @@ class BPTree (MutableMapping):
         root = self.provider.Root ()
         del root.keys [key_index]
         del root.children [child_index]
+        if root.counts is not None:
+            del root.counts [child_index]
 
         if not root.keys:
             depth = self.provider.Depth ()
@@ -289,6 +895,220 @@ class BPTree (MutableMapping):
 
         return value
 
+    #--------------------------------------------------------------------------#
+    # Delete Range                                                             #
+    #--------------------------------------------------------------------------#
+    def DeleteRange (self, low = None, high = None):
+        """Delete items in range (both bounds are inclusive)
+
+        Sub-trees covered by the range are released as a whole, only nodes on
+        the paths to the bounds are trimmed and rebalanced afterwards. Without
+        subtree counts leafs of released sub-trees are loaded to count their keys.
+
+        returns: number of deleted items
+        """
+        # provider
+        provider = self.provider
+        desc2node = provider.DescToNode
+        node2desc = provider.NodeToDesc
+
+        if low is not None and high is not None and low > high:
+            return 0
+
+        if low is None and high is None:
+            # release whole tree
+            count = provider.Size ()
+            if count:
+                provider.ReleaseTree (node2desc (provider.Root ()), provider.Depth ())
+                provider.Root (provider.NodeCreate ([], [], True))
+                provider.Depth (1)
+                provider.Size (0)
+            return count
+
+        # link of outermost leaf (if range reaches the tree edge)
+        edge_desc = None
+        if low is None or high is None:
+            node = provider.Root ()
+            for depth in range (provider.Depth () - 1):
+                node = desc2node (node.children [0 if low is None else -1])
+            edge_desc = node.prev if low is None else node.next
+
+        count, left, right = self.delete_range (provider.Root (), provider.Depth (), low, high)
+        if not count:
+            return 0
+        provider.Size (provider.Size () - count)
+
+        # keep leafs linked
+        if left is not right:
+            if left is not None:
+                left.next = edge_desc if right is None else node2desc (right)
+                provider.Dirty (left)
+            if right is not None:
+                right.prev = edge_desc if left is None else node2desc (left)
+                provider.Dirty (right)
+
+        # rebalance paths to the bounds
+        if left is not None:
+            self.range_rebalance (low, False)
+        if right is not None:
+            self.range_rebalance (high, True)
+
+        return count
+
+    def delete_range (self, node, depth, low, high):
+        """Delete items in range from sub-tree
+
+        Bound equal to None stands for the sub-tree edge, at least one bound
+        must be set.
+
+        returns: (deleted items count, leaf with low bound, leaf with high bound)
+        """
+        # provider
+        provider = self.provider
+        desc2node = provider.DescToNode
+
+        if depth <= 1:
+            begin = 0 if low is None else bisect_left (node.keys, low)
+            end = len (node.keys) if high is None else bisect (node.keys, high)
+            if begin < end:
+                keys, children = node.Chop (end)
+                node.Chop (begin)
+                node.keys.extend (keys)
+                node.children.extend (children)
+                provider.Dirty (node)
+            return max (end - begin, 0), node, node
+
+        begin = -1 if low is None else bisect (node.keys, low)
+        end = len (node.children) if high is None else bisect (node.keys, high)
+        if begin == end:
+            count, left, right = self.delete_range (desc2node (node.children [begin]), depth - 1, low, high)
+            if count:
+                if node.counts is not None:
+                    node.counts [begin] -= count
+                provider.Dirty (node)
+            return count, left, right
+
+        # boundary children
+        count, left, right = 0, None, None
+        if begin >= 0:
+            count_left, left, _ = self.delete_range (desc2node (node.children [begin]), depth - 1, low, None)
+            if node.counts is not None:
+                node.counts [begin] -= count_left
+            count += count_left
+        if end < len (node.children):
+            count_right, _, right = self.delete_range (desc2node (node.children [end]), depth - 1, None, high)
+            if node.counts is not None:
+                node.counts [end] -= count_right
+            count += count_right
+
+        # covered children
+        for index in range (begin + 1, end):
+            child_desc = node.children [index]
+            count += (node.counts [index] if node.counts is not None else
+                self.tree_count (child_desc, depth - 1))
+            provider.ReleaseTree (child_desc, depth - 1)
+        if begin < 0:
+            del node.keys [:end]
+        else:
+            del node.keys [begin:end - 1]
+        del node.children [begin + 1:end]
+        if node.counts is not None:
+            del node.counts [begin + 1:end]
+
+        if count:
+            provider.Dirty (node)
+        return count, left, right
+
+    def tree_count (self, desc, depth):
+        """Number of keys inside sub-tree"""
+        node = self.provider.DescToNode (desc)
+        if depth <= 1:
+            return len (node.keys)
+        return sum (self.tree_count (child_desc, depth - 1) for child_desc in node.children)
+
+    def range_rebalance (self, key, right):
+        """Rebalance nodes on the path to key
+
+        key:   key on the path, None for the tree edge
+        right: whether None key stands for the right edge
+        """
+        # provider
+        provider = self.provider
+        half_order = provider.Order () >> 1
+        desc2node = provider.DescToNode
+
+        while True:
+            # collapse root without keys
+            root = provider.Root ()
+            while not root.is_leaf and not root.keys:
+                provider.Root (desc2node (root.children [0]))
+                provider.Depth (provider.Depth () - 1) # depth -= 1
+                provider.Release (root)
+                root = provider.Root ()
+
+            # fix first underflowed node on the path
+            node = root
+            for depth in range (provider.Depth () - 1):
+                index = (len (node.keys) if right else 0) if key is None else bisect (node.keys, key)
+                child = desc2node (node.children [index])
+                if len (child.keys) < half_order:
+                    self.node_rebalance (node, index - 1 if index else index)
+                    break
+                node = child
+            else:
+                return
+
+    def node_rebalance (self, parent, index):
+        """Merge or evenly redistribute adjacent children of parent
+
+        index: index of left child
+        """
+        # provider
+        order = self.provider.Order ()
+        dirty = self.provider.Dirty
+        desc2node = self.provider.DescToNode
+        node2desc = self.provider.NodeToDesc
+
+        left, right = desc2node (parent.children [index]), desc2node (parent.children [index + 1])
+
+        # merge right into left
+        if not left.is_leaf:
+            left.keys.append (parent.keys [index])
+        left.keys.extend (right.keys)
+        left.children.extend (right.children)
+        if left.counts is not None:
+            left.counts.extend (right.counts)
+        dirty (left), dirty (parent)
+
+        if len (left.keys) < (order if left.is_leaf else order + 1):
+            if left.is_leaf:
+                # keep leafs linked
+                left.next = right.next
+                right_next = desc2node (right.next)
+                if right_next is not None:
+                    right_next.prev = node2desc (left)
+                    dirty (right_next)
+            if parent.counts is not None:
+                parent.counts [index] += parent.counts [index + 1]
+                del parent.counts [index + 1]
+            del parent.keys [index]
+            del parent.children [index + 1]
+            self.provider.Release (right)
+            return
+
+        # split evenly
+        center = len (left.children) >> 1
+        right.keys, right.children = left.Chop (center)
+        if left.is_leaf:
+            parent.keys [index] = separator (left.keys [-1], right.keys [0])
+        else:
+            parent.keys [index] = left.keys.pop ()
+        if left.counts is not None:
+            right.counts, left.counts = left.counts [center:], left.counts [:center]
+        if parent.counts is not None:
+            parent.counts [index], parent.counts [index + 1] = node_count (left), node_count (right)
+        dirty (right)
+
     #--------------------------------------------------------------------------#
     # Mutable Map Interface                                                    #
     #--------------------------------------------------------------------------#
@@ -324,6 +1144,95 @@ class BPTree (MutableMapping):
     def values (self):
         return map (itemgetter (1), self.GetRange ())
 
+#------------------------------------------------------------------------------#
+# Separator                                                                    #
+#------------------------------------------------------------------------------#
+def separator (left, right):
+    """Separator key of adjacent leafs
+
+    Bytes keys are truncated to the shortest prefix of the right key which
+    is still greater than the left key (left < separator <= right), which
+    keeps internal nodes small. Other keys are used as is.
+    """
+    if isinstance (left, bytes) and isinstance (right, bytes):
+        return right [:BytesPrefixSize (left, right) + 1]
+    return right
+
+#------------------------------------------------------------------------------#
+# Node Count                                                                   #
+#------------------------------------------------------------------------------#
+def node_count (node):
+    """Number of keys inside node's sub-tree (requires subtree counts)"""
+    return len (node.keys) if node.is_leaf else sum (node.counts)
+
+#------------------------------------------------------------------------------#
+# Split Bounds                                                                 #
+#------------------------------------------------------------------------------#
+def split_bounds (size, capacity, append = 0):
+    """Bounds of chunks overflowed node is split into
+
+    Nodes are split evenly, unless keys are appended at the edge of the tree.
+    Nodes left behind by appends are not going to receive new keys, so they
+    are filled up to default_append_fill of capacity and the remaining children
+    are moved to the edge node.
+
+    size:     number of node's children
+    capacity: maximum number of node's children
+    append:   split_right, split_left or 0 if keys are not appended
+    returns:  sorted bounds of chunks
+    """
+    if not append:
+        count = (size + capacity - 1) // capacity
+        return [size * index // count for index in range (1, count)]
+
+    # edge chunk always has more than capacity - fill (at least two) children
+    fill = min (int (capacity * default_append_fill), capacity - 1)
+    bounds, bound = [], 0
+    while size - bound > capacity:
+        bound += fill
+        bounds.append (bound)
+    return bounds if append == split_right else [size - bound for bound in reversed (bounds)]
+
+#------------------------------------------------------------------------------#
+# Bulk Chunks                                                                  #
+#------------------------------------------------------------------------------#
+def bulk_chunks (items, capacity, minimum, maximum):
+    """Split items into (keys, children) chunks for bulk loading
+
+    Every chunk has capacity items, except the last two which are rebalanced
+    so that the last chunk has at least minimum items whenever possible.
+    """
+    keys, children, chunk_prev = [], [], None
+    for key, child in items:
+        keys.append (key)
+        children.append (child)
+        if len (keys) >= capacity:
+            if chunk_prev is not None:
+                yield chunk_prev
+            chunk_prev, keys, children = (keys, children), [], []
+
+    if not keys:
+        if chunk_prev is not None:
+            yield chunk_prev
+        return
+    elif chunk_prev is None:
+        yield keys, children
+        return
+
+    if len (keys) >= minimum:
+        yield chunk_prev
+        yield keys, children
+        return
+
+    # last chunk is too small, merge it with previous one
+    keys, children = chunk_prev [0] + keys, chunk_prev [1] + children
+    if len (keys) <= maximum:
+        yield keys, children
+    else:
+        center = len (keys) >> 1
+        yield keys [:center], children [:center]
+        yield keys [center:], children [center:]
+
 #------------------------------------------------------------------------------#
 # B+Tree Cursor                                                                #
 #------------------------------------------------------------------------------#
@@ -395,7 +1304,7 @@ class BPTreeReversedCursor (BPTreeCursor):
             self.completed = True
             raise StopIteration ()
 
-        self.leaf, self.index = next, len (self.leaf.keys)
+        self.leaf, self.index = next, len (next.keys)
         return self.__next__ ()
 
     def __reversed__ (self):
@@ -405,10 +1314,11 @@ class BPTreeReversedCursor (BPTreeCursor):
 # B+Tree Node                                                                  #
 #------------------------------------------------------------------------------#
 class BPTreeNode (object):
-    __slots__ = ('keys', 'children', 'is_leaf',)
+    __slots__ = ('keys', 'children', 'is_leaf', 'counts',)
 
     def __init__ (self, keys, children, is_leaf = False):
         self.keys, self.children, self.is_leaf = keys, children, is_leaf
+        self.counts = None # number of keys inside each child's sub-tree (if tree maintains counts)
 
     def Chop (self, index):
         keys, self.keys = self.keys [index:], self.keys [:index]
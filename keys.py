@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Order preserving key encoding
+
+Tuple keys are encoded into bytes whose lexicographical order matches order
+of the tuples, so they can be stored in the bytes ('SS') table and compared
+with plain bytes comparison. Encoding follows the tuple layer of FoundationDB.
+"""
+import sys
+import struct
+import binascii
+from collections import MutableMapping
+
+from .bptree import null
+
+if sys.version_info [0] < 3:
+    text_type, int_types = unicode, (int, long)
+    def byte (data, index):
+        return ord (data [index])
+else:
+    text_type, int_types = str, (int,)
+    def byte (data, index):
+        return data [index]
+
+__all__ = ('KeyPack', 'KeyUnpack', 'KeyPrefixRange', 'KeyTable',)
+#------------------------------------------------------------------------------#
+# Type Codes                                                                   #
+#------------------------------------------------------------------------------#
+CODE_NONE    = 0x00
+CODE_BYTES   = 0x01
+CODE_TEXT    = 0x02
+CODE_TUPLE   = 0x05
+CODE_INT_NEG = 0x0b # negative integer longer than 8 bytes
+CODE_INT     = 0x14 # zero, (CODE_INT +/- size) integer of size bytes
+CODE_INT_POS = 0x1d # positive integer longer than 8 bytes
+CODE_DOUBLE  = 0x21
+CODE_FALSE   = 0x26
+CODE_TRUE    = 0x27
+CODE_END     = 0xff # never a type code, greater than any encoded key with the same prefix
+
+codes = tuple (struct.pack ('B', code) for code in range (256))
+double_struct = struct.Struct ('>Q')
+double_sign = 1 << 63
+
+#------------------------------------------------------------------------------#
+# Pack                                                                         #
+#------------------------------------------------------------------------------#
+def KeyPack (key):
+    """Encode key
+
+    key: tuple of None, bool, int, float, text, bytes and nested tuples,
+         other value is encoded as tuple with single item
+    returns: encoded key
+    """
+    chunks = []
+    for item in (key if isinstance (key, tuple) else (key,)):
+        pack_item (item, chunks, False)
+    return b''.join (chunks)
+
+def KeyUnpack (data):
+    """Decode key encoded with KeyPack
+
+    returns: tuple
+    """
+    items, offset = [], 0
+    while offset < len (data):
+        item, offset = unpack_item (data, offset, False)
+        items.append (item)
+    return tuple (items)
+
+def KeyPrefixRange (prefix):
+    """Encoded keys range of all keys starting with prefix
+
+    returns: (low, high) encoded bounds (both inclusive), usable with GetRange
+    """
+    low = KeyPack (prefix)
+    return low, low + codes [CODE_END]
+
+#------------------------------------------------------------------------------#
+# Key Table                                                                    #
+#------------------------------------------------------------------------------#
+class KeyTable (MutableMapping):
+    """Tuple keyed table
+
+    Wraps table with bytes keys, keys are encoded with KeyPack and decoded
+    with KeyUnpack (so non tuple keys are returned as tuples of single item).
+    """
+    def __init__ (self, table):
+        self.table = table
+
+    #--------------------------------------------------------------------------#
+    # Access                                                                   #
+    #--------------------------------------------------------------------------#
+    def Get (self, key, default = null):
+        if default is null:
+            return self.table.Get (KeyPack (key))
+        return self.table.Get (KeyPack (key), default)
+
+    def GetMany (self, keys, default = None):
+        return self.table.GetMany ([KeyPack (key) for key in keys], default)
+
+    def GetRange (self, low = None, high = None, limit = None, reverse = False, inclusive = None):
+        """Items with keys in range (see BPTree.GetRange)"""
+        for key, value in self.table.GetRange (None if low is None else KeyPack (low),
+                                               None if high is None else KeyPack (high),
+                                               limit = limit, reverse = reverse, inclusive = inclusive):
+            yield KeyUnpack (key), value
+
+    def GetPrefix (self, prefix, limit = None, reverse = False):
+        """Items with keys starting with prefix items"""
+        low, high = KeyPrefixRange (prefix)
+        for key, value in self.table.GetRange (low, high, limit = limit, reverse = reverse):
+            yield KeyUnpack (key), value
+
+    def Add (self, key, value):
+        return self.table.Add (KeyPack (key), value)
+
+    def AddMany (self, items):
+        items = items.items () if hasattr (items, 'items') else items
+        return self.table.AddMany ((KeyPack (key), value) for key, value in items)
+
+    def Pop (self, key, default = null):
+        if default is null:
+            return self.table.Pop (KeyPack (key))
+        return self.table.Pop (KeyPack (key), default)
+
+    #--------------------------------------------------------------------------#
+    # Mutable Map Interface                                                    #
+    #--------------------------------------------------------------------------#
+    def __len__ (self):
+        return len (self.table)
+
+    def __getitem__ (self, key):
+        return self.Get (key)
+
+    def __setitem__ (self, key, value):
+        return self.Add (key, value)
+
+    def __delitem__ (self, key):
+        return self.Pop (key)
+
+    def __iter__ (self):
+        for key, value in self.GetRange ():
+            yield key
+
+    def __contains__ (self, key):
+        return KeyPack (key) in self.table
+
+    def items (self):
+        return self.GetRange ()
+
+#------------------------------------------------------------------------------#
+# Private                                                                      #
+#------------------------------------------------------------------------------#
+def pack_item (item, chunks, nested):
+    if item is None:
+        chunks.append (b'\x00\xff' if nested else b'\x00')
+
+    elif item is True:
+        chunks.append (codes [CODE_TRUE])
+
+    elif item is False:
+        chunks.append (codes [CODE_FALSE])
+
+    elif isinstance (item, bytes):
+        chunks.extend ((codes [CODE_BYTES], item.replace (b'\x00', b'\x00\xff'), b'\x00'))
+
+    elif isinstance (item, text_type):
+        chunks.extend ((codes [CODE_TEXT], item.encode ('utf-8').replace (b'\x00', b'\x00\xff'), b'\x00'))
+
+    elif isinstance (item, int_types):
+        if not item:
+            chunks.append (codes [CODE_INT])
+            return
+        size = ((item if item > 0 else -item).bit_length () + 7) // 8
+        data = int_pack (item if item > 0 else item + (1 << (size * 8)) - 1, size)
+        if size <= 8:
+            chunks.append (codes [CODE_INT + size if item > 0 else CODE_INT - size])
+        elif size <= 0xff:
+            chunks.extend ((codes [CODE_INT_POS], codes [size]) if item > 0 else
+                (codes [CODE_INT_NEG], codes [size ^ 0xff]))
+        else:
+            raise ValueError ('Integer is too large to be encoded: {}'.format (item))
+        chunks.append (data)
+
+    elif isinstance (item, float):
+        value = double_struct.unpack (struct.pack ('>d', item)) [0]
+        value = value ^ 0xffffffffffffffff if value & double_sign else value | double_sign
+        chunks.extend ((codes [CODE_DOUBLE], double_struct.pack (value)))
+
+    elif isinstance (item, tuple):
+        chunks.append (codes [CODE_TUPLE])
+        for nested_item in item:
+            pack_item (nested_item, chunks, True)
+        chunks.append (b'\x00')
+
+    else:
+        raise TypeError ('Unsupported key item type: {}'.format (type (item).__name__))
+
+def unpack_item (data, offset, nested):
+    code = byte (data, offset)
+    offset += 1
+
+    if code == CODE_NONE:
+        return None, offset + 1 if nested else offset
+
+    elif code == CODE_TRUE:
+        return True, offset
+
+    elif code == CODE_FALSE:
+        return False, offset
+
+    elif code in (CODE_BYTES, CODE_TEXT):
+        chunks = []
+        while True:
+            end = data.index (b'\x00', offset)
+            chunks.append (data [offset:end])
+            if end + 1 < len (data) and byte (data, end + 1) == 0xff:
+                chunks.append (b'\x00')
+                offset = end + 2
+                continue
+            item = b''.join (chunks)
+            return (item if code == CODE_BYTES else item.decode ('utf-8')), end + 1
+
+    elif CODE_INT_NEG <= code <= CODE_INT_POS:
+        if code == CODE_INT:
+            return 0, offset
+        elif code == CODE_INT_POS:
+            size, offset = byte (data, offset), offset + 1
+        elif code == CODE_INT_NEG:
+            size, offset = byte (data, offset) ^ 0xff, offset + 1
+        else:
+            size = abs (code - CODE_INT)
+        item = int_unpack (data [offset:offset + size])
+        if code < CODE_INT:
+            item -= (1 << (size * 8)) - 1
+        return item, offset + size
+
+    elif code == CODE_DOUBLE:
+        value = double_struct.unpack (data [offset:offset + double_struct.size]) [0]
+        value = value ^ double_sign if value & double_sign else value ^ 0xffffffffffffffff
+        return struct.unpack ('>d', double_struct.pack (value)) [0], offset + double_struct.size
+
+    elif code == CODE_TUPLE:
+        items = []
+        while True:
+            if byte (data, offset) == 0x00 and (offset + 1 >= len (data) or byte (data, offset + 1) != 0xff):
+                return tuple (items), offset + 1
+            item, offset = unpack_item (data, offset, True)
+            items.append (item)
+
+    raise ValueError ('Unknown key item code: {}'.format (code))
+
+def int_pack (value, size):
+    return binascii.unhexlify ('{:0{}x}'.format (value, size * 2))
+
+def int_unpack (data):
+    return int (binascii.hexlify (data), 16)
+
+# vim: nu ft=python columns=120 :
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Merge operators
+
+Merge operator combines current value of a key with an operand, it is called
+as operator (value, operand) where value is None if key is missing, and
+returns new value of the key.
+"""
+
+__all__ = ('MergeRegister', 'MergeOperator',)
+#------------------------------------------------------------------------------#
+# Registry                                                                     #
+#------------------------------------------------------------------------------#
+operators = {} # name to operator
+
+def MergeRegister (name, operator):
+    """Register merge operator
+
+    returns: operator
+    """
+    if operators.get (name, operator) is not operator:
+        raise ValueError ('Merge operator is already registered: {}'.format (name))
+    operators [name] = operator
+    return operator
+
+def MergeOperator (operator):
+    """Resolve merge operator
+
+    operator: callable or registered name
+    """
+    if callable (operator):
+        return operator
+    merge = operators.get (operator)
+    if merge is None:
+        raise ValueError ('Unknown merge operator: {}'.format (operator))
+    return merge
+
+#------------------------------------------------------------------------------#
+# Operators                                                                    #
+#------------------------------------------------------------------------------#
+def merge_add (value, operand):
+    """Add numbers (or concatenate bytes, lists)"""
+    return operand if value is None else value + operand
+
+def merge_max (value, operand):
+    return operand if value is None else max (value, operand)
+
+def merge_min (value, operand):
+    return operand if value is None else min (value, operand)
+
+MergeRegister ('add', merge_add)
+MergeRegister ('max', merge_max)
+MergeRegister ('min', merge_min)
+
+# vim: nu ft=python columns=120 :
@@ -27,6 +27,33 @@ class Provider (object):
     def NodeCreate (self, keys, children, is_leaf):
         raise NotImplementedError ()
 
+    def NodeReserve (self, node):
+        """Assign final descriptor to created node
+
+        Node's descriptor does not change once node is reserved, so it can be
+        referenced by stored nodes before node itself is written.
+        """
+        pass
+
+    def NodeWrite (self, node):
+        """Write created node and drop it from memory
+
+        Node must be complete, it is loaded back by its descriptor if needed.
+        """
+        pass
+
+    def ReleaseTree (self, desc, depth):
+        """Release sub-tree
+
+        desc:  descriptor of sub-tree root
+        depth: depth of sub-tree (1 if desc references leaf)
+        """
+        node = self.DescToNode (desc)
+        if depth > 1:
+            for child_desc in node.children:
+                self.ReleaseTree (child_desc, depth - 1)
+        self.Release (node)
+
     def Flush (self):
         pass
 
@@ -45,6 +72,10 @@ class Provider (object):
     def Order (self):
         raise NotImplementedError ()
 
+    def Counted (self):
+        """Whether internal nodes keep number of keys inside each child's sub-tree"""
+        return False
+
     #--------------------------------------------------------------------------#
     # Dispose                                                                  #
     #--------------------------------------------------------------------------#
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
-from . import sack
+from . import sack, codec, bloom
 from .sack import *
+from .codec import *
+from .bloom import *
 
-__all__ = sack.__all__
+__all__ = sack.__all__ + codec.__all__ + bloom.__all__
 # vim: nu ft=python columns=120 :
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Bloom filter"""
+import math
+import struct
+import hashlib
+
+__all__ = ('Bloom',)
+default_bloom_capacity = 1 << 10
+
+if hasattr (hashlib, 'blake2b'):
+    def bloom_hash (key):
+        return hashlib.blake2b (key, digest_size = 16).digest ()
+else:
+    def bloom_hash (key):
+        return hashlib.md5 (key).digest ()
+
+#------------------------------------------------------------------------------#
+# Bloom Filter                                                                 #
+#------------------------------------------------------------------------------#
+class Bloom (object):
+    r"""Bloom filter of bytes keys
+
+    Bit positions are derived from a single 128-bit hash of the key with
+    double hashing. Filter can not forget keys, so it counts deletes and
+    owner is expected to rebuild it once it becomes stale or overfilled.
+
+    Dump Structure:
+        0          8      16        24       25     ?
+        +----------+------+---------+--------+------+
+        | capacity | rate | deletes | hashes | bits |
+        +----------+------+---------+--------+------+
+    """
+    header = struct.Struct ('!QdQB')
+    hash_struct = struct.Struct ('<QQ')
+
+    def __init__ (self, capacity = None, rate = .01):
+        """Create empty filter
+
+        capacity: expected number of keys
+        rate:     false positive rate at capacity
+        """
+        capacity = max (default_bloom_capacity if capacity is None else capacity, 1)
+        size = int (math.ceil (-capacity * math.log (rate) / (math.log (2) ** 2)))
+        size = max ((size + 7) & ~7, 64)
+
+        self.capacity, self.rate = capacity, rate
+        self.hashes = max (int (round (float (size) / capacity * math.log (2))), 1)
+        self.bits = bytearray (size >> 3)
+        self.deletes = 0
+        self.dirty = True
+
+        # counters (not persisted)
+        self.hits, self.skips, self.false_positives = 0, 0, 0
+
+    #--------------------------------------------------------------------------#
+    # Access                                                                   #
+    #--------------------------------------------------------------------------#
+    def Add (self, key):
+        bits = self.bits
+        for position in self.positions (key):
+            bits [position >> 3] |= 1 << (position & 7)
+        self.dirty = True
+
+    def Check (self, key):
+        """Check if key might be present and update counters"""
+        if key in self:
+            self.hits += 1
+            return True
+        self.skips += 1
+        return False
+
+    def Delete (self, count = 1):
+        """Record deletion of keys"""
+        self.deletes += count
+        self.dirty = True
+
+    def __contains__ (self, key):
+        bits = self.bits
+        for position in self.positions (key):
+            if not bits [position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def Stats (self):
+        return {
+            'capacity'        : self.capacity,
+            'rate'            : self.rate,
+            'deletes'         : self.deletes,
+            'hits'            : self.hits,
+            'skips'           : self.skips,
+            'false_positives' : self.false_positives,
+        }
+
+    #--------------------------------------------------------------------------#
+    # Save | Load                                                              #
+    #--------------------------------------------------------------------------#
+    def Save (self):
+        """Save filter
+
+        returns: serialized filter
+        """
+        self.dirty = False
+        return self.header.pack (self.capacity, self.rate, self.deletes, self.hashes) + bytes (self.bits)
+
+    @classmethod
+    def Load (cls, data):
+        """Load filter saved with Save"""
+        bloom = cls.__new__ (cls)
+        bloom.capacity, bloom.rate, bloom.deletes, bloom.hashes = cls.header.unpack_from (data)
+        bloom.bits = bytearray (data [cls.header.size:])
+        bloom.dirty = False
+        bloom.hits, bloom.skips, bloom.false_positives = 0, 0, 0
+        return bloom
+
+    #--------------------------------------------------------------------------#
+    # Private                                                                  #
+    #--------------------------------------------------------------------------#
+    def positions (self, key):
+        first, second = self.hash_struct.unpack (bloom_hash (key))
+        size = len (self.bits) << 3
+        return ((first + index * second) % size for index in range (self.hashes))
+
+# vim: nu ft=python columns=120 :
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
+import sys
 import array
 import struct
 
-from ...utils  import BytesList, ArraySave, ArrayLoad
+from ...utils  import (BytesList, BytesPack, BytesPrefixSave, BytesPrefixLoad, BytesPrefixUnpack,
+    ArraySave, ArrayLoad, ArrayUnpack)
 from ...bptree import BPTreeNode, BPTreeLeaf
 
-__all__ = ('None', 'Leaf',)
+__all__ = ('Node', 'Leaf', 'PrefixNode', 'PrefixLeaf', 'OverflowLeaf', 'PrefixOverflowLeaf',)
 #------------------------------------------------------------------------------#
 # Node                                                                         #
 #------------------------------------------------------------------------------#
@@ -71,16 +73,16 @@ class Leaf (BPTreeLeaf):
 
     def __init__ (self, keys, children, desc):
         BPTreeLeaf.__init__ (self,
-            keys if isinstance (keys, BytesList) else BytesList (keys),
-            children if isinstance (children, BytesList) else BytesList (children))
+            keys if isinstance (keys, BytesPack) else BytesPack (keys),
+            children if isinstance (children, BytesPack) else BytesPack (children))
         self.desc, self.prev, self.next = desc, 0, 0
 
     #--------------------------------------------------------------------------#
     # Chop                                                                     #
     #--------------------------------------------------------------------------#
     def Chop (self, index):
-        keys, self.keys = BytesList (self.keys [index:]), BytesList (self.keys [:index])
-        children, self.children = BytesList (self.children [index:]), BytesList (self.children [:index])
+        keys, self.keys = self.keys [index:], self.keys [:index]
+        children, self.children = self.children [index:], self.children [:index]
         return keys, children
 
     #--------------------------------------------------------------------------#
@@ -90,17 +92,192 @@ class Leaf (BPTreeLeaf):
         stream.write (self.header.pack (self.prev, self.next))
 
     def Save (self, stream):
-        self.keys.Save (stream)
-        self.children.Save (stream)
+        self.keys_save (stream)
+        self.values_save (stream)
 
     @classmethod
     def Load (cls, desc, stream):
         prev, next = cls.header.unpack (stream.read (cls.header.size))
-        keys = BytesList.Load (stream)
-        children = BytesList.Load (stream)
+        keys = cls.keys_load (stream)
+        children = cls.values_load (stream)
 
         node = cls (keys, children, desc)
         node.prev, node.next = prev, next
         return node
 
+    @classmethod
+    def LoadView (cls, desc, buffer, offset):
+        """Load leaf without copying keys and children
+
+        Keys and children are sliced out of the buffer only when accessed.
+        """
+        prev, next = cls.header.unpack_from (buffer, offset)
+        keys, offset = cls.keys_view (buffer, offset + cls.header.size)
+        children, offset = cls.values_view (buffer, offset)
+
+        node = cls (keys, children, desc)
+        node.prev, node.next = prev, next
+        return node
+
+    #--------------------------------------------------------------------------#
+    # Private                                                                  #
+    #--------------------------------------------------------------------------#
+    def keys_save (self, stream):
+        self.keys.Save (stream)
+
+    def values_save (self, stream):
+        self.children.Save (stream)
+
+    @classmethod
+    def keys_load (cls, stream):
+        return BytesPack.Load (stream)
+
+    @classmethod
+    def values_load (cls, stream):
+        return BytesPack.Load (stream)
+
+    @classmethod
+    def keys_view (cls, buffer, offset):
+        return BytesPack.View (buffer, offset)
+
+    @classmethod
+    def values_view (cls, buffer, offset):
+        return BytesPack.View (buffer, offset)
+
+#------------------------------------------------------------------------------#
+# Prefix Node                                                                  #
+#------------------------------------------------------------------------------#
+class PrefixNode (Node):
+    """B+Tree Bytes Node with front coded keys (see BytesPrefixSave)"""
+    __slots__ = tuple ()
+
+    def Save (self, stream):
+        BytesPrefixSave (stream, self.keys)
+        ArraySave (stream, self.children)
+
+    @classmethod
+    def Load (cls, desc, stream):
+        count    = cls.header.unpack (stream.read (cls.header.size)) [0]
+        keys     = BytesList (BytesPrefixLoad (stream))
+        children = ArrayLoad (stream, cls.array_type, count)
+
+        return cls (keys, children, desc)
+
+#------------------------------------------------------------------------------#
+# Prefix Leaf                                                                  #
+#------------------------------------------------------------------------------#
+class PrefixLeaf (Leaf):
+    """B+Tree Bytes Leaf with front coded keys (see BytesPrefixSave)
+
+    Keys are decoded when leaf is loaded, children are sliced out of the
+    buffer only when accessed.
+    """
+    __slots__ = tuple ()
+
+    def keys_save (self, stream):
+        BytesPrefixSave (stream, self.keys)
+
+    @classmethod
+    def keys_load (cls, stream):
+        return BytesPack (BytesPrefixLoad (stream))
+
+    @classmethod
+    def keys_view (cls, buffer, offset):
+        keys, offset = BytesPrefixUnpack (buffer, offset)
+        return BytesPack (keys), offset
+
+#------------------------------------------------------------------------------#
+# Overflow Leaf                                                                #
+#------------------------------------------------------------------------------#
+class OverflowDesc (int):
+    """Descriptor of value stored out of line"""
+    __slots__ = tuple ()
+
+class OverflowList (list):
+    """Values list where out of line values are fetched from sack on access"""
+    __slots__ = ('sack',)
+
+    def __init__ (self, items = tuple (), sack = None):
+        list.__init__ (self, items)
+        self.sack = sack
+
+    def __getitem__ (self, index):
+        item = list.__getitem__ (self, index)
+        if item.__class__ is OverflowDesc:
+            return self.sack.Get (item)
+        elif isinstance (index, slice):
+            return OverflowList (item, self.sack)
+        return item
+
+    if sys.version_info [0] < 3:
+        def __getslice__ (self, begin, end):
+            return self.__getitem__ (slice (begin, end))
+
+class OverflowLeaf (Leaf):
+    r"""B+Tree Bytes Leaf with out of line values
+
+    Large values are pushed to the sack by the provider and replaced with
+    their descriptors (OverflowDesc). Iteration over children and pop
+    return descriptors, so values can be moved between leafs without being
+    loaded. Descriptors referenced when leaf was loaded or last saved are
+    kept in overflow, so provider can release unreferenced values.
+
+    Dump Structure:
+        0      8      16     ?          ?                 + 2           + (2 * count)
+        +------+------+------+----------+-----------------+---------------+
+        | prev | next | keys | children | overflow count  | overflow index |
+        +------+------+------+----------+-----------------+---------------+
+    """
+    __slots__ = ('overflow',)
+    sack = None # set by provider
+    overflow_header = struct.Struct ('!H')
+    overflow_desc = struct.Struct ('!Q')
+
+    def __init__ (self, keys, children, desc):
+        BPTreeLeaf.__init__ (self,
+            keys if isinstance (keys, BytesPack) else BytesPack (keys),
+            children if isinstance (children, OverflowList) else OverflowList (children, self.sack))
+        self.desc, self.prev, self.next = desc, 0, 0
+        self.overflow = self.OverflowDescs ()
+
+    def OverflowDescs (self):
+        """Set of descriptors of out of line values"""
+        return set (child for child in list.__iter__ (self.children) if child.__class__ is OverflowDesc)
+
+    #--------------------------------------------------------------------------#
+    # Private                                                                  #
+    #--------------------------------------------------------------------------#
+    def values_save (self, stream):
+        children, indices = [], array.array ('H')
+        for index, child in enumerate (list.__iter__ (self.children)):
+            if child.__class__ is OverflowDesc:
+                indices.append (index)
+                child = self.overflow_desc.pack (child)
+            children.append (child)
+        BytesList (children).Save (stream)
+        stream.write (self.overflow_header.pack (len (indices)))
+        ArraySave (stream, indices)
+
+    @classmethod
+    def values_load (cls, stream):
+        children = OverflowList (BytesList.Load (stream), cls.sack)
+        count = cls.overflow_header.unpack (stream.read (cls.overflow_header.size)) [0]
+        for index in ArrayLoad (stream, 'H', count):
+            list.__setitem__ (children, index, OverflowDesc (cls.overflow_desc.unpack (children [index]) [0]))
+        return children
+
+    @classmethod
+    def values_view (cls, buffer, offset):
+        children, offset = BytesPack.View (buffer, offset)
+        children = OverflowList (children, cls.sack)
+        count = cls.overflow_header.unpack_from (buffer, offset) [0]
+        offset += cls.overflow_header.size
+        for index in ArrayUnpack ('H', buffer [offset:offset + 2 * count]):
+            list.__setitem__ (children, index, OverflowDesc (cls.overflow_desc.unpack (children [index]) [0]))
+        return children, offset + 2 * count
+
+class PrefixOverflowLeaf (PrefixLeaf, OverflowLeaf):
+    """B+Tree Bytes Leaf with front coded keys and out of line values"""
+    __slots__ = tuple ()
+
 # vim: nu ft=python columns=120 :
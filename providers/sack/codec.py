@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Node compression codecs"""
+import sys
+import zlib
+
+__all__ = ('Codec', 'CodecRegister', 'CodecCreate', 'ZlibCodec', 'LzmaCodec', 'Bz2Codec', 'ZlibDictCodec',)
+#------------------------------------------------------------------------------#
+# Registry                                                                     #
+#------------------------------------------------------------------------------#
+codecs = {} # name and identifier to codec type
+
+def CodecRegister (codec_type):
+    """Register codec type
+
+    Identifier is stored in table header, so it must never change.
+    """
+    for key in (codec_type.id, codec_type.name):
+        if codecs.get (key, codec_type) is not codec_type:
+            raise ValueError ('Codec is already registered: {}'.format (key))
+        codecs [key] = codec_type
+    return codec_type
+
+def CodecCreate (codec, level = None):
+    """Create codec
+
+    codec: codec instance, registered name or identifier
+    level: compression level (codec default if None)
+    """
+    if isinstance (codec, Codec):
+        return codec
+    codec_type = codecs.get (codec)
+    if codec_type is None:
+        raise ValueError ('Unknown codec: {}'.format (codec))
+    return codec_type (level)
+
+#------------------------------------------------------------------------------#
+# Codec                                                                        #
+#------------------------------------------------------------------------------#
+class Codec (object):
+    """Compression codec
+
+    Codecs with dictionary are trained from sampled node bodies, dictionary
+    is stored in the sack by the provider.
+    """
+    id = None
+    name = None
+
+    def __init__ (self, level = None):
+        self.level = level
+
+    def Compress (self, data):
+        raise NotImplementedError ()
+
+    def Decompress (self, data):
+        raise NotImplementedError ()
+
+    #--------------------------------------------------------------------------#
+    # Dictionary                                                               #
+    #--------------------------------------------------------------------------#
+    @property
+    def NeedsTraining (self):
+        """Whether codec wants a dictionary trained"""
+        return False
+
+    @property
+    def Dictionary (self):
+        return None
+
+    @Dictionary.setter
+    def Dictionary (self, dictionary):
+        raise TypeError ('Codec {} does not support dictionary'.format (self.name))
+
+    def Train (self, samples):
+        """Train dictionary from samples"""
+        raise TypeError ('Codec {} does not support dictionary'.format (self.name))
+
+    def __repr__ (self):
+        return '{}(level={})'.format (type (self).__name__, self.level)
+
+#------------------------------------------------------------------------------#
+# Zlib                                                                         #
+#------------------------------------------------------------------------------#
+@CodecRegister
+class ZlibCodec (Codec):
+    id, name = 1, 'zlib'
+
+    def Compress (self, data):
+        return zlib.compress (data, -1 if self.level is None else self.level)
+
+    def Decompress (self, data):
+        return zlib.decompress (data)
+
+#------------------------------------------------------------------------------#
+# Lzma                                                                         #
+#------------------------------------------------------------------------------#
+@CodecRegister
+class LzmaCodec (Codec):
+    id, name = 2, 'lzma'
+
+    def __init__ (self, level = None):
+        import lzma # not available on python 2
+        Codec.__init__ (self, level)
+        self.lzma = lzma
+
+    def Compress (self, data):
+        return self.lzma.compress (data, preset = self.level)
+
+    def Decompress (self, data):
+        return self.lzma.decompress (data)
+
+#------------------------------------------------------------------------------#
+# Bz2                                                                          #
+#------------------------------------------------------------------------------#
+@CodecRegister
+class Bz2Codec (Codec):
+    id, name = 3, 'bz2'
+
+    def __init__ (self, level = None):
+        import bz2
+        Codec.__init__ (self, level)
+        self.bz2 = bz2
+
+    def Compress (self, data):
+        return self.bz2.compress (data, 9 if self.level is None else self.level)
+
+    def Decompress (self, data):
+        return self.bz2.decompress (data)
+
+#------------------------------------------------------------------------------#
+# Zlib with Dictionary                                                         #
+#------------------------------------------------------------------------------#
+@CodecRegister
+class ZlibDictCodec (ZlibCodec):
+    """Zlib with preset dictionary
+
+    Until dictionary is trained data is compressed without it. Whether
+    dictionary is used is recorded in zlib header (FDICT bit), so both
+    kinds of data can be decompressed. Python 2 zlib does not support preset
+    dictionaries, so there dictionary is never trained (nor used).
+    """
+    id, name = 4, 'zdict'
+    dictionary_size = 1 << 15 # zlib window size
+    samples_size = 1 << 16    # minimal size of samples to train from
+    supported = sys.version_info [0] >= 3
+
+    def __init__ (self, level = None):
+        ZlibCodec.__init__ (self, level)
+        self.dictionary = None
+
+    def Compress (self, data):
+        if self.dictionary is None or not self.supported:
+            return ZlibCodec.Compress (self, data)
+        compressor = zlib.compressobj (-1 if self.level is None else self.level, zlib.DEFLATED, zlib.MAX_WBITS,
+            zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        return compressor.compress (data) + compressor.flush ()
+
+    def Decompress (self, data):
+        if not ord (data [1:2]) & 0x20: # FDICT
+            return zlib.decompress (data)
+        if self.dictionary is None:
+            raise ValueError ('Data is compressed with dictionary, but dictionary is not set')
+        if not self.supported:
+            raise ValueError ('Data is compressed with dictionary, which is not supported on python 2')
+        decompressor = zlib.decompressobj (zlib.MAX_WBITS, self.dictionary)
+        return decompressor.decompress (data) + decompressor.flush ()
+
+    #--------------------------------------------------------------------------#
+    # Dictionary                                                               #
+    #--------------------------------------------------------------------------#
+    @property
+    def NeedsTraining (self):
+        return self.dictionary is None and self.supported
+
+    @property
+    def Dictionary (self):
+        return self.dictionary
+
+    @Dictionary.setter
+    def Dictionary (self, dictionary):
+        self.dictionary = dictionary
+
+    def Train (self, samples):
+        """Train dictionary from samples
+
+        Dictionary is made of chunks taken from the middle of evenly picked
+        samples, so it covers typical keys and values of the table.
+
+        returns: True if dictionary has been trained (enough samples)
+        """
+        samples = [sample for sample in samples if sample]
+        if sum (len (sample) for sample in samples) < self.samples_size:
+            return False
+
+        chunk_size = max (self.dictionary_size // len (samples), 256)
+        chunks = []
+        for sample in samples [::max (len (samples) * chunk_size // self.dictionary_size, 1)]:
+            offset = max (len (sample) - chunk_size, 0) >> 1
+            chunks.append (sample [offset:offset + chunk_size])
+        self.dictionary = b''.join (chunks) [-self.dictionary_size:]
+        return True
+
+# vim: nu ft=python columns=120 :
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from ...utils import ArraySave, ArrayLoad, ArrayUInt64
+
+__all__ = ('Counts',)
+#------------------------------------------------------------------------------#
+# Counts                                                                       #
+#------------------------------------------------------------------------------#
+counts_cache = {}
+def Counts (node_type):
+    """Resolve node type which keeps subtree counts
+
+    node_type: internal node type to be extended
+    """
+    counts_type = counts_cache.get (node_type)
+    if counts_type is None:
+        counts_type = type ('Node', (CountsNode, node_type), {'__slots__': tuple ()})
+        counts_cache [node_type] = counts_type
+    return counts_type
+
+#------------------------------------------------------------------------------#
+# Counts Node                                                                  #
+#------------------------------------------------------------------------------#
+class CountsNode (object):
+    r"""B+Tree Node with number of keys inside each child's sub-tree
+
+    Counts are appended after data of extended node type.
+
+    Dump Structure:
+        0      ?                 + (8 * count)
+        +------+-----------------+
+        | node | children counts |
+        +------+-----------------+
+    """
+    __slots__ = tuple ()
+    counts_type = ArrayUInt64
+
+    def Save (self, stream):
+        super (CountsNode, self).Save (stream)
+        ArraySave (stream, self.counts)
+
+    @classmethod
+    def Load (cls, desc, stream):
+        node = super (CountsNode, cls).Load (desc, stream)
+        node.counts = ArrayLoad (stream, cls.counts_type, len (node.children))
+        return node
+
+# vim: nu ft=python columns=120 :
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import sys
+import array
+import struct
+
+from ...utils  import BytesPack, ArraySave, ArrayLoad, ArrayUnpack
+from ...bptree import BPTreeNode, BPTreeLeaf
+
+__all__ = ('Types',)
+#------------------------------------------------------------------------------#
+# Types                                                                        #
+#------------------------------------------------------------------------------#
+key_codes   = 'bBhHiIlLqQfd'
+value_codes = key_codes + 'S' # 'S' is bytes
+
+# 64-bit codes are not supported by Python 2 arrays (long is 64-bit on LP64 platforms)
+array_codes = {} if sys.version_info [0] >= 3 else {'q': 'l', 'Q': 'L'}
+
+types_cache = {}
+def Types (code):
+    """Resolve (Node, Leaf) types for type code
+
+    code: two character code, first is array type code of keys, second is
+          array type code of values or 'S' for bytes values
+    """
+    types = types_cache.get (code)
+    if types is None:
+        if len (code) != 2 or code [0] not in key_codes or code [1] not in value_codes:
+            raise TypeError ('Unsupported type \'{}\''.format (code))
+        key_type, value_type = array_codes.get (code [0], code [0]), array_codes.get (code [1], code [1])
+        attrs = {
+            '__slots__'  : tuple (),
+            'key_type'   : key_type,
+            'key_size'   : array.array (key_type).itemsize,
+            'value_type' : value_type,
+            'value_size' : 0 if value_type == 'S' else array.array (value_type).itemsize,
+        }
+        types = type ('Node', (Node,), attrs), type ('Leaf', (Leaf,), attrs)
+        types_cache [code] = types
+    return types
+
+#------------------------------------------------------------------------------#
+# Node                                                                         #
+#------------------------------------------------------------------------------#
+class Node (BPTreeNode):
+    r"""B+Tree Numeric Node
+
+    Dump Structure:
+        0       2      ?           + (8 * count)
+        +-------+------+----------+
+        | count | keys | children |
+        +-------+------+----------+
+    """
+    __slots__ = ('keys', 'children', 'is_leaf', 'desc')
+    header = struct.Struct ('!H')
+    array_type = 'l'
+    key_type, key_size = None, 0
+
+    def __init__ (self, keys, children, desc):
+        BPTreeNode.__init__ (self,
+            keys if isinstance (keys, array.array) else array.array (self.key_type, keys),
+            children if isinstance (children, array.array) else array.array (self.array_type, children))
+        self.desc = desc
+
+    #--------------------------------------------------------------------------#
+    # Save | Load                                                              #
+    #--------------------------------------------------------------------------#
+    def SaveHeader (self, stream):
+        stream.write (self.header.pack (len (self.children)))
+
+    def Save (self, stream):
+        ArraySave (stream, self.keys)
+        ArraySave (stream, self.children)
+
+    @classmethod
+    def Load (cls, desc, stream):
+        count    = cls.header.unpack (stream.read (cls.header.size)) [0]
+        keys     = ArrayLoad (stream, cls.key_type, count - 1)
+        children = ArrayLoad (stream, cls.array_type, count)
+
+        return cls (keys, children, desc)
+
+#------------------------------------------------------------------------------#
+# Leaf                                                                         #
+#------------------------------------------------------------------------------#
+class Leaf (BPTreeLeaf):
+    r"""B+Tree Numeric Leaf
+
+    Dump Structure:
+        0      8      16      18     ?          ?
+        +------+------+-------+------+----------+
+        | prev | next | count | keys | children |
+        +------+------+-------+------+----------+
+    """
+    __slots__ = ('keys', 'children', 'is_leaf', 'prev', 'next', 'desc')
+    header = struct.Struct ('!QQH')
+    key_type, key_size = None, 0
+    value_type, value_size = None, 0
+
+    def __init__ (self, keys, children, desc):
+        if self.value_type == 'S':
+            children = children if isinstance (children, BytesPack) else BytesPack (children)
+        elif not isinstance (children, array.array):
+            children = array.array (self.value_type, children)
+        BPTreeLeaf.__init__ (self,
+            keys if isinstance (keys, array.array) else array.array (self.key_type, keys), children)
+        self.desc, self.prev, self.next = desc, 0, 0
+
+    #--------------------------------------------------------------------------#
+    # Save | Load                                                              #
+    #--------------------------------------------------------------------------#
+    def SaveHeader (self, stream):
+        stream.write (self.header.pack (self.prev, self.next, len (self.keys)))
+
+    def Save (self, stream):
+        ArraySave (stream, self.keys)
+        if self.value_type == 'S':
+            self.children.Save (stream)
+        else:
+            ArraySave (stream, self.children)
+
+    @classmethod
+    def Load (cls, desc, stream):
+        prev, next, count = cls.header.unpack (stream.read (cls.header.size))
+        keys = ArrayLoad (stream, cls.key_type, count)
+        children = (BytesPack.Load (stream) if cls.value_type == 'S' else
+            ArrayLoad (stream, cls.value_type, count))
+
+        node = cls (keys, children, desc)
+        node.prev, node.next = prev, next
+        return node
+
+    @classmethod
+    def LoadView (cls, desc, buffer, offset):
+        """Load leaf directly from buffer"""
+        prev, next, count = cls.header.unpack_from (buffer, offset)
+        offset += cls.header.size
+
+        keys = ArrayUnpack (cls.key_type, buffer [offset:offset + count * cls.key_size])
+        offset += count * cls.key_size
+        if cls.value_type == 'S':
+            children, offset = BytesPack.View (buffer, offset)
+        else:
+            children = ArrayUnpack (cls.value_type, buffer [offset:offset + count * cls.value_size])
+
+        node = cls (keys, children, desc)
+        node.prev, node.next = prev, next
+        return node
+
+# vim: nu ft=python columns=120 :
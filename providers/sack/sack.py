@@ -2,29 +2,46 @@
 """Sack Provider"""
 import io
 import struct
-import zlib
-from bisect import bisect
+from bisect      import bisect
+from collections import OrderedDict
 
 # local
 from .. import Provider
+from ...sack.page import PageTable
+from .codec import CodecCreate, ZlibCodec
+from .bytes import OverflowDesc
+from .bloom import Bloom
 
-__all__ = ('SackProvider', 'FLAG_COMPRESSION')
+__all__ = ('SackProvider', 'FLAG_COMPRESSION', 'FLAG_PAGE_TABLE', 'FLAG_PREFIX', 'FLAG_CODEC', 'FLAG_OVERFLOW',
+    'FLAG_BLOOM', 'FLAG_COUNTS')
 #------------------------------------------------------------------------------#
 # Flags                                                                        #
 #------------------------------------------------------------------------------#
-FLAG_COMPRESSION = 1
+FLAG_COMPRESSION = 1 # zlib with default level
+FLAG_PAGE_TABLE  = 2 # nodes are referenced by logical identifiers
+FLAG_PREFIX      = 4 # keys are front coded (bytes keys only)
+FLAG_CODEC       = 8 # nodes are compressed with codec stored in header
+FLAG_OVERFLOW    = 16 # large values are stored out of line (bytes values only)
+FLAG_BLOOM       = 32 # bloom filter of keys is maintained (bytes keys only)
+FLAG_COUNTS      = 64 # internal nodes keep subtree counts (order statistics)
 
 #------------------------------------------------------------------------------#
 # B+Tree Sack Provider                                                         #
 #------------------------------------------------------------------------------#
 class SackProvider (Provider):
-    def __init__ (self, sack, order = None, type = None, cell = 0, flags = None):
+    def __init__ (self, sack, order = None, type = None, cell = 0, flags = None, cache_size = None, codec = None,
+        overflow = None, bloom = None):
         """Sack Provider
 
-        sack  : sack backing store
-        order : maximum children count inside node
-        cell  : cell with header
-        type  : sack type
+        sack       : sack backing store
+        order      : maximum children count inside node
+        cell       : cell with header
+        type       : sack type ('SS' bytes, 'PP' pickle, or numeric like 'QQ', 'QS', 'qd'
+                     where each character is array type code and 'S' stands for bytes)
+        cache_size : maximum number of clean leafs kept in memory (unbounded if None)
+        codec      : nodes compression codec (instance or registered name, see codec module)
+        overflow   : values larger than overflow (in bytes) are stored out of line
+        bloom      : false positive rate of keys bloom filter (no filter if None)
         """
         self.sack = sack
         self.order = order
@@ -37,12 +54,29 @@ class SackProvider (Provider):
         #   'I'  depth
         #   'Q'  size
         #   'Q'  root descriptor
+        #   'Q'  page table descriptor (only with FLAG_PAGE_TABLE)
+        #   'B'  codec identifier      (only with FLAG_CODEC)
+        #   'q'  codec level           (only with FLAG_CODEC, -1 is codec's default)
+        #   'Q'  codec dictionary      (only with FLAG_CODEC, 0 if codec has no dictionary)
+        #   'I'  overflow threshold    (only with FLAG_OVERFLOW)
+        #   'Q'  bloom filter          (only with FLAG_BLOOM)
         ###
         self.header = struct.Struct ('!2sQIIQQ')
+        self.header_pages = struct.Struct ('!Q')
+        self.header_codec = struct.Struct ('!BqQ')
+        self.header_overflow = struct.Struct ('!I')
+        self.header_bloom = struct.Struct ('!Q')
 
         self.d2n = {}
         self.dirty = set ()
         self.desc_next = -1
+        self.codec_samples = [] # samples of leafs until codec dictionary is trained
+        self.reserved = {}      # serialized bodies of reserved nodes
+
+        # leafs cache (internal nodes are always kept in memory)
+        self.cache = OrderedDict ()
+        self.cache_size = cache_size
+        self.cache_hits, self.cache_misses, self.cache_evictions = 0, 0, 0
 
         self.cell = cell
         header = self.sack.Cell [cell]
@@ -50,6 +84,31 @@ class SackProvider (Provider):
             type , self.flags, self.order, self.depth, self.size, root_desc = self.header.unpack_from (header)
             type = type.decode ('utf-8')
             self.type_resolve (type)
+
+            offset = self.header.size
+            self.pages = None
+            if self.flags & FLAG_PAGE_TABLE:
+                self.pages = PageTable (sack, self.header_pages.unpack_from (header, offset) [0])
+                offset += self.header_pages.size
+
+            self.codec, self.codec_desc = ZlibCodec () if self.flags & FLAG_COMPRESSION else None, None
+            if self.flags & FLAG_CODEC:
+                codec_id, codec_level, codec_desc = self.header_codec.unpack_from (header, offset)
+                self.codec = CodecCreate (codec_id, None if codec_level < 0 else codec_level)
+                if codec_desc:
+                    self.codec.Dictionary, self.codec_desc = self.sack.Get (codec_desc), codec_desc
+                offset += self.header_codec.size
+
+            self.overflow, self.overflow_released = None, set ()
+            if self.flags & FLAG_OVERFLOW:
+                self.overflow = self.header_overflow.unpack_from (header, offset) [0]
+                offset += self.header_overflow.size
+
+            self.bloom, self.bloom_desc = None, None
+            if self.flags & FLAG_BLOOM:
+                self.bloom_desc = self.header_bloom.unpack_from (header, offset) [0]
+                self.bloom = Bloom.Load (self.sack.Get (self.bloom_desc))
+
             self.root = self.node_load (root_desc)
         else:
             # cell is not set create new provider
@@ -59,8 +118,24 @@ class SackProvider (Provider):
                 raise ValueError ('Type is required to create new provider')
 
             # init provider
-            self.type_resolve (type)
             self.flags = 0 if flags is None else flags
+            self.overflow, self.overflow_released = overflow, set ()
+            if overflow is not None:
+                self.flags |= FLAG_OVERFLOW
+            self.bloom, self.bloom_desc = None, None
+            if bloom is not None:
+                self.flags |= FLAG_BLOOM
+                self.bloom = Bloom (rate = bloom)
+            self.type_resolve (type)
+            self.codec, self.codec_desc = ZlibCodec () if self.flags & FLAG_COMPRESSION else None, None
+            if codec is not None:
+                if self.flags & FLAG_COMPRESSION:
+                    raise ValueError ('Codec can not be used together with FLAG_COMPRESSION')
+                self.codec = CodecCreate (codec)
+                if self.codec.level is not None and not 0 <= self.codec.level < 1 << 63:
+                    raise ValueError ('Codec level must be non-negative: {}'.format (self.codec.level))
+                self.flags |= FLAG_CODEC
+            self.pages = PageTable (sack) if self.flags & FLAG_PAGE_TABLE else None
             self.order = order
             self.depth = 1
             self.size  = 0
@@ -70,10 +145,62 @@ class SackProvider (Provider):
 
     def Flush (self):
         """Flush cached values"""
+        if self.flags & FLAG_OVERFLOW:
+            self.overflow_flush ()
+        if self.codec is not None and self.codec.NeedsTraining:
+            self.codec_train ()
 
-        # relocated nodes
+        if self.pages is None:
+            self.nodes_flush ()
+        else:
+            self.pages_flush ()
+        self.cache_evict ()
+
+        #--------------------------------------------------------------------------#
+        # Flush Header                                                             #
+        #--------------------------------------------------------------------------#
+        header = self.header.pack (self.type.encode ('utf-8'), self.flags, self.order,
+            self.depth, self.size, self.root.desc)
+        if self.pages is not None:
+            header += self.header_pages.pack (self.pages.Flush ())
+        if self.flags & FLAG_CODEC:
+            header += self.header_codec.pack (self.codec.id, -1 if self.codec.level is None else self.codec.level,
+                self.codec_desc or 0)
+        if self.flags & FLAG_OVERFLOW:
+            header += self.header_overflow.pack (self.overflow)
+        if self.flags & FLAG_BLOOM:
+            if self.bloom.dirty:
+                self.bloom_desc = self.sack.Push (self.bloom.Save (), self.bloom_desc)
+            header += self.header_bloom.pack (self.bloom_desc)
+        self.sack.Cell [self.cell] = header
+
+        #--------------------------------------------------------------------------#
+        # Flush Sack                                                               #
+        #--------------------------------------------------------------------------#
+        self.sack.Flush ()
+
+    def nodes_flush (self):
+        """Flush dirty nodes referenced by sack descriptors
+
+        Relocated node requires update of its parent and its siblings. Space
+        of relocated node is freed immediately and might be reused within the
+        same flush, so parent's reference is updated as soon as node is
+        relocated and old descriptors are only used to update leafs links.
+        """
+        # relocated leafs
         d2n_reloc = {}
 
+        def parent_update (node, desc):
+            """Replace reference to relocated node inside its parent"""
+            parent, key = self.root, node.keys [0]
+            while True:
+                index = bisect (parent.keys, key)
+                if parent.children [index] == node.desc:
+                    break
+                parent = self.DescToNode (parent.children [index])
+            parent.children [index] = desc
+            node_queue.add (parent) # parent might have been flushed already
+
         #--------------------------------------------------------------------------#
         # Flush Leafs                                                              #
         #--------------------------------------------------------------------------#
@@ -81,7 +208,7 @@ class SackProvider (Provider):
         def leaf_enqueue (leaf):
             body = io.BytesIO ()
             leaf.Save (body)
-            body = zlib.compress (body.getvalue ()) if self.flags & FLAG_COMPRESSION else body.getvalue ()
+            body = body.getvalue () if self.codec is None else self.codec.Compress (body.getvalue ())
 
             # enqueue leaf
             leaf_queue [leaf] = body
@@ -91,16 +218,9 @@ class SackProvider (Provider):
 
             # check if node has been relocated
             if leaf.desc != desc:
-                # queue parent for update
+                # update parent
                 if leaf is not self.root:
-                    parent, key = self.root, leaf.keys [0]
-                    while True:
-                        parent_desc = parent.children [bisect (parent.keys, key)]
-                        if parent_desc == leaf.desc:
-                            break
-                        parent = self.DescToNode (parent_desc)
-                    if parent not in self.dirty:
-                        node_queue.add (parent)
+                    parent_update (leaf, desc)
 
                 # queue next and previous for update
                 for sibling_desc in (leaf.prev, leaf.next):
@@ -121,6 +241,7 @@ class SackProvider (Provider):
 
                 # update descriptor maps
                 self.d2n.pop (leaf.desc)
+                self.cache.pop (leaf.desc, None)
                 d2n_reloc [leaf.desc], leaf.desc = leaf, desc
                 self.d2n [desc] = leaf
 
@@ -153,31 +274,28 @@ class SackProvider (Provider):
             desc = self.sack.Push (data.getvalue (), leaf.desc)
             assert leaf.desc == desc
 
+            # leaf is clean now
+            self.cache [desc] = leaf
+
         #--------------------------------------------------------------------------#
         # Flush Nodes                                                              #
         #--------------------------------------------------------------------------#
         def node_flush (node):
             # flush children
             for index in range (len (node.children)):
-                child_desc = node.children [index]
-                child = d2n_reloc.get (child_desc)
-                if child is not None:
-                    # child has already been flushed
-                    node.children [index] = child.desc
-                else:
-                    child = self.d2n.get (child_desc)
-                    if child in node_queue:
-                        # flush child and update index
-                        node.children [index] = node_flush (child)
+                child = self.d2n.get (node.children [index])
+                if child in node_queue:
+                    # flush child and update index
+                    node.children [index] = node_flush (child)
 
             # save
             data = io.BytesIO ()
             data.write (b'\x00') # unset leaf flag
             node.SaveHeader (data)
-            if self.flags & FLAG_COMPRESSION:
+            if self.codec is not None:
                 body = io.BytesIO ()
                 node.Save (body)
-                data.write (zlib.compress (body.getvalue ()))
+                data.write (self.codec.Compress (body.getvalue ()))
             else:
                 node.Save (data)
 
@@ -186,20 +304,13 @@ class SackProvider (Provider):
 
             # check if node has been relocated
             if node.desc != desc:
-                # queue parent for update
+                # update parent
                 if node is not self.root:
-                    parent, key = self.root, node.keys [0]
-                    while True:
-                        parent_desc = parent.children [bisect (parent.keys, key)]
-                        if parent_desc == node.desc:
-                            break
-                        parent = self.d2n [parent_desc]
-                    if parent not in self.dirty:
-                        node_queue.add (parent)
+                    parent_update (node, desc)
 
                 # update descriptor maps
                 self.d2n.pop (node.desc)
-                d2n_reloc [node.desc], node.desc = node, desc
+                node.desc = desc
                 self.d2n [desc] = node
 
             # remove node from dirty set
@@ -212,17 +323,33 @@ class SackProvider (Provider):
 
         # clear dirty set
         self.dirty.clear ()
+        self.reserved.clear ()
 
-        #--------------------------------------------------------------------------#
-        # Flush Header                                                             #
-        #--------------------------------------------------------------------------#
-        self.sack.Cell [self.cell] = self.header.pack (self.type.encode ('utf-8'), self.flags, self.order,
-            self.depth, self.size, self.root.desc)
+    def pages_flush (self):
+        """Flush dirty nodes referenced by logical identifiers
 
-        #--------------------------------------------------------------------------#
-        # Flush Sack                                                               #
-        #--------------------------------------------------------------------------#
-        self.sack.Flush ()
+        Relocated node only updates its page table entry.
+        """
+        for node in self.dirty:
+            data = io.BytesIO ()
+            data.write (b'\x01' if node.is_leaf else b'\x00') # leaf flag
+            node.SaveHeader (data)
+            if self.codec is not None:
+                body = io.BytesIO ()
+                node.Save (body)
+                data.write (self.codec.Compress (body.getvalue ()))
+            else:
+                node.Save (data)
+
+            # put node in sack
+            self.pages.Set (node.desc, self.sack.Push (data.getvalue (), self.pages.Get (node.desc)))
+
+            # leaf is clean now
+            if node.is_leaf:
+                self.cache [node.desc] = node
+
+        # clear dirty set
+        self.dirty.clear ()
 
     #--------------------------------------------------------------------------#
     # Provider Interface                                                       #
@@ -232,19 +359,58 @@ class SackProvider (Provider):
 
     def DescToNode (self, desc):
         if desc:
-            return self.d2n.get (desc) or self.node_load (desc)
+            node = self.d2n.get (desc)
+            if node is None:
+                self.cache_misses += 1
+                node = self.node_load (desc)
+                if node.is_leaf:
+                    self.cache_evict ()
+            else:
+                self.cache_hits += 1
+                if desc in self.cache:
+                    self.cache [desc] = self.cache.pop (desc) # most recently used
+            return node
 
     def Dirty (self, node):
+        # dirty nodes are never evicted
         self.dirty.add (node)
+        self.cache.pop (node.desc, None)
+        self.d2n [node.desc] = node
 
     def Release (self, node):
-        self.d2n.pop (node.desc)
+        if node.is_leaf and self.flags & FLAG_OVERFLOW:
+            self.overflow_released.update (node.overflow) # released on flush unless moved to another leaf
+        self.d2n.pop (node.desc, None)
+        self.cache.pop (node.desc, None)
         self.dirty.discard (node)
-        if node.desc >= 0:
-            self.sack.Pop (node.desc)
+        self.desc_release (node.desc)
+
+    def ReleaseTree (self, desc, depth):
+        """Release sub-tree
+
+        Leafs which are not in memory are released by their descriptors without
+        being loaded, unless they might reference out of line values.
+        """
+        if depth > 1:
+            node = self.DescToNode (desc)
+            for child_desc in node.children:
+                self.ReleaseTree (child_desc, depth - 1)
+            self.Release (node)
+            return
+
+        leaf = self.d2n.get (desc)
+        if leaf is None and self.flags & FLAG_OVERFLOW:
+            leaf = self.node_load (desc)
+        if leaf is not None:
+            self.Release (leaf)
+        else:
+            self.desc_release (desc)
 
     def NodeCreate (self, keys, children, is_leaf):
-        desc, self.desc_next = self.desc_next, self.desc_next - 1
+        if self.pages is not None:
+            desc = self.pages.Alloc ()
+        else:
+            desc, self.desc_next = self.desc_next, self.desc_next - 1
         node = (self.leaf_type (keys, children, desc) if is_leaf else
             self.node_type (keys, children, desc))
 
@@ -252,6 +418,41 @@ class SackProvider (Provider):
         self.dirty.add (node)
         return node
 
+    def NodeReserve (self, node):
+        """Assign final descriptor to created node
+
+        Space of serialized node is reserved in the sack. Identifiers of page
+        table are final already.
+        """
+        if self.pages is not None or node.desc >= 0:
+            return
+        body = self.node_body (node)
+        desc = self.sack.Reserve (len (body) + node.header.size + 1, None)
+        self.d2n.pop (node.desc)
+        node.desc, self.d2n [desc], self.reserved [node] = desc, node, body
+
+    def NodeWrite (self, node):
+        """Write created node and drop it from memory"""
+        self.NodeReserve (node)
+        body = self.reserved.pop (node, None)
+        if body is None:
+            body = self.node_body (node)
+
+        data = io.BytesIO ()
+        data.write (b'\x01' if node.is_leaf else b'\x00') # leaf flag
+        node.SaveHeader (data)
+        data.write (body)
+
+        if self.pages is None:
+            desc = self.sack.Push (data.getvalue (), node.desc)
+            assert node.desc == desc
+        else:
+            self.pages.Set (node.desc, self.sack.Push (data.getvalue (), self.pages.Get (node.desc)))
+
+        # node is clean and loaded back on access
+        self.d2n.pop (node.desc, None)
+        self.dirty.discard (node)
+
     def Size (self, value = None):
         self.size = self.size if value is None else value
         return self.size
@@ -267,6 +468,34 @@ class SackProvider (Provider):
     def Order (self):
         return self.order
 
+    def Counted (self):
+        return bool (self.flags & FLAG_COUNTS)
+
+    #--------------------------------------------------------------------------#
+    # Cache                                                                    #
+    #--------------------------------------------------------------------------#
+    @property
+    def CacheStats (self):
+        """Leafs cache statistics"""
+        return {
+            'size'      : len (self.cache),
+            'capacity'  : self.cache_size,
+            'hits'      : self.cache_hits,
+            'misses'    : self.cache_misses,
+            'evictions' : self.cache_evictions,
+        }
+
+    def cache_evict (self):
+        """Evict least recently used clean leafs until cache fits its size"""
+        if self.cache_size is None:
+            return
+        while len (self.cache) > self.cache_size:
+            desc, node = self.cache.popitem (last = False)
+            if node is self.root or node in self.dirty:
+                continue # pinned
+            self.d2n.pop (desc, None)
+            self.cache_evictions += 1
+
     #--------------------------------------------------------------------------#
     # Dispose                                                                  #
     #--------------------------------------------------------------------------#
@@ -278,29 +507,127 @@ class SackProvider (Provider):
     # Private                                                                  #
     #--------------------------------------------------------------------------#
     def node_load (self, desc):
-        # load data
-        data = io.BytesIO (self.sack.Get (desc))
-        type = self.leaf_type if data.read (1) == b'\x01' else self.node_type
-        if self.flags & FLAG_COMPRESSION:
+        # load data (buffer might be memory mapped)
+        buffer, offset, size = self.sack.View (desc if self.pages is None else self.pages.Get (desc))
+        type = self.leaf_type if buffer [offset:offset + 1] == b'\x01' else self.node_type
+        offset, end = offset + 1, offset + size
+        if self.codec is not None:
             stream = io.BytesIO ()
-            stream.write (data.read (type.header.size))
-            stream.write (zlib.decompress (data.read ()))
+            stream.write (buffer [offset:offset + type.header.size])
+            stream.write (self.codec.Decompress (buffer [offset + type.header.size:end]))
             stream.seek (0)
             node = type.Load (desc, stream)
+        elif hasattr (type, 'LoadView'):
+            node = type.LoadView (desc, buffer, offset)
         else:
-            node = type.Load (desc, data)
+            node = type.Load (desc, io.BytesIO (buffer [offset:end]))
 
         self.d2n [desc] = node
+        if node.is_leaf:
+            self.cache [desc] = node
         return node
 
-    def type_resolve (self, type):
-        self.type = type
-        if type == 'SS':
-            from .bytes import Node, Leaf
-            self.node_type, self.leaf_type = Node, Leaf
-        elif type == 'PP':
+    def node_body (self, node):
+        """Serialize node written outside of flush
+
+        Large values of leaf are pushed out of line and leaf is sampled for
+        codec dictionary, as flush only does it for dirty leafs.
+        """
+        if node.is_leaf and self.flags & FLAG_OVERFLOW:
+            self.overflow_push (node)
+            node.overflow = node.OverflowDescs ()
+
+        body = io.BytesIO ()
+        node.Save (body)
+        body = body.getvalue ()
+        if self.codec is None:
+            return body
+        if node.is_leaf and self.codec.NeedsTraining:
+            self.codec_samples.append (body)
+            if self.codec.Train (self.codec_samples):
+                self.codec_samples = []
+                self.codec_desc = self.sack.Push (self.codec.Dictionary)
+        return self.codec.Compress (body)
+
+    def desc_release (self, desc):
+        """Release sack space of node"""
+        if self.pages is not None:
+            desc = self.pages.Free (desc)
+            if desc is not None:
+                self.sack.Free (desc)
+        elif desc >= 0:
+            self.sack.Free (desc)
+
+    def overflow_flush (self):
+        """Push large values of dirty leafs out of line and release unreferenced ones
+
+        Values only move between dirty leafs, so descriptors referenced by
+        dirty (and released) leafs before and not after modification are
+        no longer used.
+        """
+        released, referenced = self.overflow_released, set ()
+        for node in self.dirty:
+            if not node.is_leaf:
+                continue
+            self.overflow_push (node)
+            released.update (node.overflow)
+            node.overflow = node.OverflowDescs ()
+            referenced.update (node.overflow)
+
+        for desc in released - referenced:
+            self.sack.Free (desc)
+        self.overflow_released = set ()
+
+    def overflow_push (self, leaf):
+        """Push large values of leaf out of line"""
+        children = leaf.children
+        for index, child in enumerate (list.__iter__ (children)):
+            if child.__class__ is bytes and len (child) > self.overflow:
+                list.__setitem__ (children, index, OverflowDesc (self.sack.Push (child)))
+
+    def codec_train (self):
+        """Train codec dictionary from dirty leafs and store it in the sack
+
+        Samples are collected across flushes until there is enough of them,
+        and dropped once dictionary has been trained.
+        """
+        for node in self.dirty:
+            if node.is_leaf:
+                body = io.BytesIO ()
+                node.Save (body)
+                self.codec_samples.append (body.getvalue ())
+        if self.codec.Train (self.codec_samples):
+            self.codec_samples = []
+            self.codec_desc = self.sack.Push (self.codec.Dictionary)
+
+    def type_resolve (self, type_code):
+        self.type = type_code
+        if self.flags & FLAG_PREFIX and type_code != 'SS':
+            raise ValueError ('Prefix compression is only supported by \'SS\' type')
+        if self.flags & FLAG_OVERFLOW and type_code != 'SS':
+            raise ValueError ('Overflow values are only supported by \'SS\' type')
+        if self.flags & FLAG_BLOOM and type_code != 'SS':
+            raise ValueError ('Bloom filter is only supported by \'SS\' type')
+
+        if type_code == 'SS':
+            from .bytes import Node, Leaf, PrefixNode, PrefixLeaf, OverflowLeaf, PrefixOverflowLeaf
+            if self.flags & FLAG_OVERFLOW:
+                # out of line values are fetched from this provider's sack
+                leaf_type = type ('Leaf', (PrefixOverflowLeaf if self.flags & FLAG_PREFIX else OverflowLeaf,),
+                    {'__slots__': tuple (), 'sack': self.sack})
+            else:
+                leaf_type = PrefixLeaf if self.flags & FLAG_PREFIX else Leaf
+            self.node_type, self.leaf_type = PrefixNode if self.flags & FLAG_PREFIX else Node, leaf_type
+        elif type_code == 'PP':
             from .pickle import Node, Leaf
             self.node_type, self.leaf_type = Node, Leaf
+        elif len (type_code) == 2 and type_code [0] in 'bBhHiIlLqQfd':
+            from .numeric import Types
+            self.node_type, self.leaf_type = Types (type_code)
         else:
-            raise TypeError ('Unsupported type \'{}\''.format (type))
+            raise TypeError ('Unsupported type \'{}\''.format (type_code))
+
+        if self.flags & FLAG_COUNTS:
+            from .counts import Counts
+            self.node_type = Counts (self.node_type)
 # vim: nu ft=python columns=120 :
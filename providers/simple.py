@@ -7,11 +7,12 @@ __all__ = ('SimpleProvider',)
 # B+Tree Simple Provider                                                       #
 #------------------------------------------------------------------------------#
 class SimpleProvider (Provider):
-    def __init__ (self, order):
+    def __init__ (self, order, counted = False):
         self.root = self.NodeCreate ([], [], True)
         self.size  = 0
         self.depth = 1
         self.order = order
+        self.counted = counted
 
     def NodeToDesc (self, node):
         return node
@@ -43,4 +44,7 @@ class SimpleProvider (Provider):
 
     def Order (self):
         return self.order
+
+    def Counted (self):
+        return self.counted
 # vim: nu ft=python columns=120 :
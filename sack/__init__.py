@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from .stream import StreamSack
 from .file   import FileSack
+from .pfile  import PFileSack
 
-__all__ = ('StreamSack', 'FileSack')
+__all__ = ('StreamSack', 'FileSack', 'PFileSack')
 # vim: nu ft=python columns=120 :
@@ -1,15 +1,37 @@
 # -*- coding: utf-8 -*-
 import struct
-from array  import array
-from bisect import insort, bisect_left
+from array import array
+from heapq import heapify, heappush, heappop
 
-from ..utils import ArraySave, ArrayLoad
+from ..utils import ArraySave, ArrayLoad, ArrayUInt64
 
 __all__ = ('BuddyAllocator', 'AllocatorError')
+#------------------------------------------------------------------------------#
+# Journal Operations                                                           #
+#------------------------------------------------------------------------------#
+JOURNAL_ALLOC = 0
+JOURNAL_FREE  = 1
+JOURNAL_GROW  = 2
+
 #------------------------------------------------------------------------------#
 # Buddy Allocator                                                              #
 #------------------------------------------------------------------------------#
 class BuddyAllocator (object):
+    """Buddy Allocator
+
+    Free blocks of each order are kept in a set (membership and removal) and
+    in a heap of offsets (lowest free block lookup). Heap entries are removed
+    lazily, so both allocation and deallocation are O(log n).
+
+    When there is no free block of sufficient size allocator grows (doubles
+    its size) until order_max is reached, existing offsets stay valid.
+
+    Operations are recorded in a journal, so state can be persisted as a Save
+    checkpoint followed by saved journals which are replayed on top of it.
+    """
+    order_max = 56 # descriptor stores offset in 56 bits
+    journal_header = struct.Struct ('!I')
+
     def __init__ (self, order, map = None):
         """Initialize
 
@@ -20,10 +42,16 @@ class BuddyAllocator (object):
 
         # initialize map
         if map is None:
-            self.map = [array ('L') for k in range (order + 1)]
-            self.map [order].append (0)
+            self.map = [set () for k in range (order + 1)]
+            self.map [order].add (0)
         else:
-            self.map = map
+            self.map = [set (blocks) for blocks in map]
+        self.heap = [list (blocks) for blocks in self.map]
+        for heap in self.heap:
+            heapify (heap)
+
+        # journal of (operation, order | offset << 8)
+        self.journal_ops, self.journal_descs = array ('B'), array (ArrayUInt64)
 
     def AllocOrder (self, order):
         """Allocate block
@@ -31,23 +59,25 @@ class BuddyAllocator (object):
         order: block's order
         returns: block's offset
         """
-        map_order = order
-        # find not empty map of sufficient size
-        while map_order <= self.order:
-            map = self.map [map_order]
-            if not map:
-                map_order += 1
-                continue
-            block = map.pop (0)
+        while True:
+            map_order = order
+            # find not empty map of sufficient size
+            while map_order <= self.order:
+                map = self.map [map_order]
+                if not map:
+                    map_order += 1
+                    continue
+                block = self.heap_pop (map_order)
 
-            # split block until best-fit is found
-            while map_order > order:
-                map_order -= 1
-                insort (self.map [map_order], block + (1 << map_order))
+                # split block until best-fit is found
+                while map_order > order:
+                    map_order -= 1
+                    self.block_push (map_order, block + (1 << map_order))
 
-            return block
+                self.journal_push (JOURNAL_ALLOC, block, order)
+                return block
 
-        raise AllocatorError ('out of space')
+            self.Grow ()
 
     def Alloc (self, size):
         """Allocate block
@@ -64,24 +94,56 @@ class BuddyAllocator (object):
         offset: block's offset
         order:  block's order
         """
-        while order < self.order:
-            buddy_offset = offset ^ (1 << order)
-            map = self.map [order]
+        self.journal_push (JOURNAL_FREE, offset, order)
+        self.block_free (offset, order)
 
-            # check if buddy is in a free map
-            buddy_index = bisect_left (map, buddy_offset)
-            if not map or buddy_index >= len (map) or buddy_offset != map [buddy_index]:
-                map.insert (buddy_index, offset)
-                return
+    def Grow (self, order = None):
+        """Grow allocator
 
-            # merge with buddy
-            map.pop (buddy_index)
-            if offset & (1 << order):
-                offset = buddy_offset
-            order += 1
+        order: new allocator's order (doubles size if not specified)
+        """
+        order = self.order + 1 if order is None else order
+        if order > self.order_max:
+            raise AllocatorError ('out of space')
 
-        # last and the only block
-        self.map [order].append (offset)
+        self.journal_push (JOURNAL_GROW, 0, order)
+        self.grow (order)
+
+    #--------------------------------------------------------------------------#
+    # Journal                                                                  #
+    #--------------------------------------------------------------------------#
+    @property
+    def JournalSize (self):
+        """Number of recorded operations"""
+        return len (self.journal_ops)
+
+    def JournalClear (self):
+        """Forget recorded operations"""
+        self.journal_ops, self.journal_descs = array ('B'), array (ArrayUInt64)
+
+    def JournalSave (self, stream):
+        """Save recorded operations to stream"""
+        stream.write (self.journal_header.pack (len (self.journal_ops)))
+        ArraySave (stream, self.journal_ops)
+        ArraySave (stream, self.journal_descs)
+
+    def JournalReplay (self, stream):
+        """Replay operations saved with JournalSave
+
+        Replayed operations are not recorded.
+        """
+        count = self.journal_header.unpack (stream.read (self.journal_header.size)) [0]
+        ops, descs = ArrayLoad (stream, 'B', count), ArrayLoad (stream, ArrayUInt64, count)
+        for op, desc in zip (ops, descs):
+            offset, order = desc >> 8, desc & 0xff
+            if op == JOURNAL_ALLOC:
+                self.block_alloc_at (offset, order)
+            elif op == JOURNAL_FREE:
+                self.block_free (offset, order)
+            elif op == JOURNAL_GROW:
+                self.grow (order)
+            else:
+                raise AllocatorError ('unknown journal operation: {}'.format (op))
 
     #--------------------------------------------------------------------------#
     # Debug Helpers                                                            #
@@ -96,11 +158,88 @@ class BuddyAllocator (object):
     def IsAddressUsed (self, address):
         """Check if given address is used"""
         for order, map in enumerate (self.map):
-            for offset in map:
-                if offset <= address < offset + (1 << order):
-                    return False
+            if (address >> order) << order in map:
+                return False
         return True
 
+    #--------------------------------------------------------------------------#
+    # Private                                                                  #
+    #--------------------------------------------------------------------------#
+    def block_push (self, order, offset):
+        """Add free block"""
+        self.map [order].add (offset)
+        heap = self.heap [order]
+        heappush (heap, offset)
+
+        # drop stale entries when heap becomes too large
+        if len (heap) > 2 * len (self.map [order]) + 64:
+            heap [:] = self.map [order]
+            heapify (heap)
+
+    def heap_pop (self, order):
+        """Pop free block with the lowest offset"""
+        map, heap = self.map [order], self.heap [order]
+        while True:
+            offset = heappop (heap)
+            if offset in map:
+                map.discard (offset)
+                return offset
+
+    def block_alloc_at (self, offset, order):
+        """Allocate block at specified offset"""
+        for map_order in range (order, self.order + 1):
+            block = (offset >> map_order) << map_order
+            if block not in self.map [map_order]:
+                continue
+            self.map [map_order].discard (block) # heap entry is removed lazily
+
+            # split block until requested one is found
+            while map_order > order:
+                map_order -= 1
+                half = block + (1 << map_order)
+                if offset >= half:
+                    self.block_push (map_order, block)
+                    block = half
+                else:
+                    self.block_push (map_order, half)
+            return
+
+        raise AllocatorError ('block is not free: offset={} order={}'.format (offset, order))
+
+    def block_free (self, offset, order):
+        """Free block and merge it with its buddies"""
+        while order < self.order:
+            buddy_offset = offset ^ (1 << order)
+            map = self.map [order]
+
+            # check if buddy is in a free map
+            if buddy_offset not in map:
+                self.block_push (order, offset)
+                return
+
+            # merge with buddy (heap entry is removed lazily)
+            map.discard (buddy_offset)
+            if offset & (1 << order):
+                offset = buddy_offset
+            order += 1
+
+        # last and the only block
+        self.block_push (order, offset)
+
+    def grow (self, order):
+        """Grow allocator up to specified order"""
+        while self.order < order:
+            self.map.append (set ())
+            self.heap.append ([])
+            self.order += 1
+
+            # previous space is merged with new buddy if it is completely free
+            self.block_free (1 << (self.order - 1), self.order - 1)
+
+    def journal_push (self, op, offset, order):
+        self.journal_ops.append (op)
+        self.journal_descs.append (order | offset << 8)
+
     #--------------------------------------------------------------------------#
     # Save | Load                                                              #
     #--------------------------------------------------------------------------#
@@ -109,7 +248,7 @@ class BuddyAllocator (object):
         stream.write (struct.pack ('B', self.order))
         ArraySave (stream, array ('I', (len (map) for map in self.map)))
         for map in self.map:
-            ArraySave (stream, map)
+            ArraySave (stream, array ('L', sorted (map)))
 
     @classmethod
     def Load (cls, stream):
@@ -10,8 +10,17 @@ __all__ = ('Cell',)
 class Cell (object):
     def __init__ (self, sack, desc = None):
         self.sack, self.desc = sack, desc
-        self.array = BytesList () if not desc else \
-            BytesList.Load (io.BytesIO (self.sack.Get (desc)))
+        self.array_state = BytesList () if not desc else None # loaded on demand
+
+    @property
+    def array (self):
+        if self.array_state is None:
+            self.array_state = BytesList.Load (io.BytesIO (self.sack.Get (self.desc)))
+        return self.array_state
+
+    @array.setter
+    def array (self, array):
+        self.array_state = array
 
     #--------------------------------------------------------------------------#
     # Access Items                                                             #
@@ -54,6 +63,8 @@ class Cell (object):
         """Flush content"""
         if self.sack.IsReadOnly:
             raise RuntimeError ('Backing store is readonly')
+        if self.array_state is None:
+            return # has never been accessed
 
         data = io.BytesIO ()
         self.array = BytesList (self.array [:len (self)])
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import # standard mmap module is shadowed by this module on Python 2
 import os
 import mmap
 import struct
@@ -46,6 +47,18 @@ class MMapSack (StreamSack):
 
         StreamSack.__init__ (self, stream, offset, order, is_new, readonly = readonly)
 
+    #--------------------------------------------------------------------------#
+    # Access Data                                                              #
+    #--------------------------------------------------------------------------#
+    def View (self, desc):
+        """Get data without copying it
+
+        returns: (mmap, offset, size)
+        """
+        offset = self.data_offset + (desc >> 8) # desc.offset
+        return (self.stream, offset + self.data_header.size,
+            self.data_header.unpack_from (self.stream, offset) [0])
+
     #--------------------------------------------------------------------------#
     # Dispose                                                                  #
     #--------------------------------------------------------------------------#
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import io
+import struct
+from array import array
+
+from ..utils import ArraySave, ArrayLoad, ArrayUInt64
+
+__all__ = ('PageTable',)
+#------------------------------------------------------------------------------#
+# Page Table                                                                   #
+#------------------------------------------------------------------------------#
+class PageTable (object):
+    r"""Page Table
+
+    Maps logical identifiers to sack descriptors, so data can be relocated by
+    updating single entry. Entries are grouped in pages which are stored as
+    separate sack blobs, and only modified pages are pushed on flush. Free
+    entries form a linked list (free entry holds next free identifier shifted
+    by 8, which is never a valid descriptor as its order is zero).
+
+    Directory Dump Structure:
+        0       8           16           ?
+        +-------+-----------+------------+
+        | count | free head | page descs |
+        +-------+-----------+------------+
+    """
+    header = struct.Struct ('!QQ')
+    page_size = 512
+
+    def __init__ (self, sack, desc = None):
+        self.sack, self.desc = sack, desc
+        self.pages = {}
+        self.pages_dirty = set ()
+
+        if desc:
+            data = io.BytesIO (self.sack.Get (desc))
+            self.count, self.free = self.header.unpack (data.read (self.header.size))
+            self.directory = ArrayLoad (data, ArrayUInt64, (self.count + self.page_size - 1) // self.page_size)
+        else:
+            self.count, self.free = 1, 0 # identifier 0 is reserved
+            self.directory = array (ArrayUInt64)
+
+    #--------------------------------------------------------------------------#
+    # Access                                                                   #
+    #--------------------------------------------------------------------------#
+    def Alloc (self):
+        """Allocate identifier
+
+        returns: new identifier (not mapped to any descriptor)
+        """
+        if self.free:
+            ident = self.free
+            page = self.page (ident // self.page_size, True)
+            self.free, page [ident % self.page_size] = page [ident % self.page_size] >> 8, 0
+        else:
+            ident, self.count = self.count, self.count + 1
+            if ident // self.page_size >= len (self.directory):
+                self.directory.append (0)
+            self.page (ident // self.page_size, True)
+        return ident
+
+    def Free (self, ident):
+        """Free identifier
+
+        returns: descriptor identifier was mapped to or None
+        """
+        page = self.page (ident // self.page_size, True)
+        desc, page [ident % self.page_size] = page [ident % self.page_size], self.free << 8
+        self.free = ident
+        return desc or None
+
+    def Get (self, ident):
+        """Get descriptor mapped to identifier"""
+        return self.page (ident // self.page_size) [ident % self.page_size] or None
+
+    def Set (self, ident, desc):
+        """Map identifier to descriptor"""
+        self.page (ident // self.page_size, True) [ident % self.page_size] = desc
+
+    def __len__ (self):
+        return self.count - 1
+
+    #--------------------------------------------------------------------------#
+    # Flush                                                                    #
+    #--------------------------------------------------------------------------#
+    def Flush (self):
+        """Push modified pages and directory
+
+        returns: directory descriptor
+        """
+        for index in sorted (self.pages_dirty):
+            data = io.BytesIO ()
+            ArraySave (data, self.pages [index])
+            self.directory [index] = self.sack.Push (data.getvalue (), self.directory [index] or None)
+        self.pages_dirty.clear ()
+
+        data = io.BytesIO ()
+        data.write (self.header.pack (self.count, self.free))
+        ArraySave (data, self.directory)
+        self.desc = self.sack.Push (data.getvalue (), self.desc)
+
+        return self.desc
+
+    #--------------------------------------------------------------------------#
+    # Drop                                                                     #
+    #--------------------------------------------------------------------------#
+    def Drop (self):
+        """Release pages and directory (mapped descriptors are not released)"""
+        for desc in self.directory:
+            if desc:
+                self.sack.Free (desc)
+        if self.desc:
+            self.sack.Free (self.desc)
+        self.pages.clear ()
+        self.pages_dirty.clear ()
+        self.directory, self.desc = array (ArrayUInt64), None
+
+    #--------------------------------------------------------------------------#
+    # Private                                                                  #
+    #--------------------------------------------------------------------------#
+    def page (self, index, dirty = False):
+        page = self.pages.get (index)
+        if page is None:
+            desc = self.directory [index]
+            if desc:
+                page = ArrayLoad (io.BytesIO (self.sack.Get (desc)), ArrayUInt64, self.page_size)
+            else:
+                page = array (ArrayUInt64, (0,) * self.page_size)
+            self.pages [index] = page
+        if dirty:
+            self.pages_dirty.add (index)
+        return page
+
+# vim: nu ft=python columns=120 :
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+
+from .sack   import Sack
+from .stream import StreamSack
+
+__all__ = ('PFileSack',)
+default_read_size = 1 << 16 # 64Kb
+
+#------------------------------------------------------------------------------#
+# Positional File Sack                                                         #
+#------------------------------------------------------------------------------#
+class PFileSack (StreamSack):
+    """Positional I/O (pread|pwrite) based File Sack
+
+    Does not use shared file position, so Get performs a single system call
+    for data up to read_size (block capacity is known from descriptor) and is
+    safe to call concurrently from multiple threads.
+
+    Mode:
+        'r' : Open existing sack for reading only
+        'w' : Open existing sack for reading and writing
+        'c' : Open existing sack for reading and writing, create if it doesn't exists
+        'n' : Always create a new sack
+    """
+    def __init__ (self, file, mode = 'r', order = None, offset = 0, read_size = None):
+        if not hasattr (os, 'pread'):
+            raise RuntimeError ('Positional I/O is not supported on this platform')
+        if mode in ('c', 'n') and order is None:
+            raise ValueError ('order must be provided for \'c\' and \'n\' modes')
+
+        self.mode = mode
+        self.read_size = default_read_size if read_size is None else read_size
+
+        # headers
+        self.data_header = struct.Struct ('!I')
+        self.header = struct.Struct ('!QQ')
+
+        self.stream = None
+        self.offset = offset
+        self.data_offset = offset + self.header.size
+
+        # open file
+        new = False
+        if mode == 'r':
+            self.fd = os.open (file, os.O_RDONLY)
+        elif mode == 'w':
+            self.fd = os.open (file, os.O_RDWR)
+        elif mode == 'c':
+            new = not os.path.lexists (file)
+            self.fd = os.open (file, os.O_RDWR | os.O_CREAT, 0o644)
+        elif mode == 'n':
+            new = True
+            self.fd = os.open (file, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        else:
+            raise ValueError ('Unsupported open mode')
+
+        if new:
+            Sack.__init__ (self, None, None, order)
+            self.Flush ()
+        else:
+            alloc_desc, cell_desc = self.header.unpack (os.pread (self.fd, self.header.size, offset))
+            Sack.__init__ (self, cell_desc, alloc_desc, readonly = mode == 'r')
+
+    #--------------------------------------------------------------------------#
+    # Access Data                                                              #
+    #--------------------------------------------------------------------------#
+    def Push (self, data, desc = None):
+        """Push data
+
+        data: data to be pushed
+        desc: data's previous descriptor if any
+        returns: new data's descriptor
+        """
+        # try to save in previous location
+        if desc is not None:
+            if len (data) + self.data_header.size <= 1 << (desc & 0xff): # desc.capacity
+                os.pwrite (self.fd, self.data_header.pack (len (data)) + data, self.data_offset + (desc >> 8))
+                return desc
+            self.alloc.Free (desc >> 8, desc & 0xff) # desc.offset, desc.order
+
+        # allocate new block
+        offset, order = self.alloc.Alloc (len (data) + self.data_header.size)
+        try:
+            os.pwrite (self.fd, self.data_header.pack (len (data)) + data, self.data_offset + offset)
+            return order | offset << 8 # desc
+        except Exception:
+            self.alloc.Free (offset, order)
+            raise
+
+    def Get (self, desc):
+        """Get data
+
+        desc: data's descriptor
+        returns: data
+        """
+        offset = self.data_offset + (desc >> 8) # desc.offset
+        block = os.pread (self.fd, min (1 << (desc & 0xff), self.read_size), offset) # desc.capacity
+        size = self.data_header.unpack_from (block) [0]
+        if size + self.data_header.size <= len (block):
+            return block [self.data_header.size:self.data_header.size + size]
+
+        # data is larger than read size
+        return block [self.data_header.size:] + os.pread (self.fd,
+            size + self.data_header.size - len (block), offset + len (block))
+
+    #--------------------------------------------------------------------------#
+    # Flush                                                                    #
+    #--------------------------------------------------------------------------#
+    def Flush (self):
+        Sack.Flush (self)
+
+        # flush header
+        os.pwrite (self.fd, self.header.pack (self.alloc_desc, self.Cell.desc), self.offset)
+
+    #--------------------------------------------------------------------------#
+    # Dispose                                                                  #
+    #--------------------------------------------------------------------------#
+    def Dispose (self):
+        StreamSack.Dispose (self)
+        os.close (self.fd)
+
+# vim: nu ft=python columns=120 :
@@ -1,24 +1,50 @@
 # -*- coding: utf-8 -*-
 import io
+import struct
 from .alloc import BuddyAllocator
 from .cell  import Cell
 
 __all__ = ('Sack',)
+#------------------------------------------------------------------------------#
+# Allocator Persistence                                                        #
+#------------------------------------------------------------------------------#
+alloc_segment_magic = b'\xffJ' # never a valid first byte of allocator checkpoint
+alloc_segment_header = struct.Struct ('!Q')
+alloc_segments_max = 64
+alloc_journal_min = 1 << 16
+
 #------------------------------------------------------------------------------#
 # Sack                                                                         #
 #------------------------------------------------------------------------------#
 class Sack (object):
+    r"""Sack
+
+    Allocator is persisted as full state checkpoint followed by a chain of
+    journal segments, each holding operations since previous flush. Allocator
+    descriptor refers to the latest segment (or checkpoint if there are none).
+    Existing allocator is loaded only when it is accessed for the first time,
+    so readers which never allocate do not pay for it.
+
+    Journal Segment Dump Structure:
+        0       2           10
+        +-------+-----------+---------+
+        | magic | prev desc | journal |
+        +-------+-----------+---------+
+    """
     def __init__ (self, cell_desc, alloc_desc, order = None, readonly = None):
         self.readonly = False if readonly is None else readonly
 
         # allocator
         self.alloc_desc = alloc_desc
+        self.alloc_segments = []
+        self.alloc_journal_size = 0
         if alloc_desc:
-            self.alloc = BuddyAllocator.Load (io.BytesIO (self.Get (self.alloc_desc)))
+            self.alloc_state = None # loaded on demand
         else:
             if order is None:
                 raise ValueError ('Order is required when creating new sack')
-            self.alloc = BuddyAllocator (order)
+            self.alloc_state = BuddyAllocator (order)
+            self.alloc_checkpoint, self.alloc_checkpoint_size = None, 0
 
         # cell
         self.cell = Cell (self, cell_desc)
@@ -38,6 +64,17 @@ class Sack (object):
     def Pop (self, desc):
         raise NotImplementedError ('Abstract method')
 
+    def Free (self, desc):
+        raise NotImplementedError ('Abstract method')
+
+    def View (self, desc):
+        """Get data without copying it if possible
+
+        returns: (buffer, offset, size) data is buffer [offset:offset + size]
+        """
+        data = self.Get (desc)
+        return data, 0, len (data)
+
     #--------------------------------------------------------------------------#
     # Properties                                                               #
     #--------------------------------------------------------------------------#
@@ -49,6 +86,14 @@ class Sack (object):
     def IsReadOnly (self):
         return self.readonly
 
+    @property
+    def alloc (self):
+        alloc = self.alloc_state
+        if alloc is None:
+            self.alloc_load ()
+            alloc = self.alloc_state
+        return alloc
+
     #--------------------------------------------------------------------------#
     # Flush                                                                    #
     #--------------------------------------------------------------------------#
@@ -59,15 +104,16 @@ class Sack (object):
         # flush cells
         self.Cell.Flush ()
 
-        # flush allocator
-        while True:
-            state = io.BytesIO ()
-            self.alloc.Save (state)
-            desc = self.Push (state.getvalue (), self.alloc_desc)
-            if desc == self.alloc_desc:
-                self.alloc_desc = desc
-                break
-            self.alloc_desc = desc
+        # flush allocator (untouched allocator has not been loaded)
+        if self.alloc_state is None:
+            return
+        journal_size = self.alloc_journal_size + self.alloc.JournalSize * 9
+        if (self.alloc_checkpoint is None or
+            len (self.alloc_segments) >= alloc_segments_max or
+            journal_size > max (self.alloc_checkpoint_size, alloc_journal_min)):
+            self.alloc_checkpoint_flush ()
+        elif self.alloc.JournalSize:
+            self.alloc_segment_flush ()
 
     #--------------------------------------------------------------------------#
     # Dispose                                                                  #
@@ -83,4 +129,62 @@ class Sack (object):
         self.Dispose ()
         return False
 
+    #--------------------------------------------------------------------------#
+    # Private                                                                  #
+    #--------------------------------------------------------------------------#
+    def alloc_load (self):
+        """Load allocator checkpoint and replay journal segments"""
+        desc, segments = self.alloc_desc, []
+        while True:
+            data = self.Get (desc)
+            if data [:len (alloc_segment_magic)] != alloc_segment_magic:
+                break
+            segments.append ((desc, data))
+            desc = alloc_segment_header.unpack_from (data, len (alloc_segment_magic)) [0]
+
+        self.alloc_state = BuddyAllocator.Load (io.BytesIO (data))
+        self.alloc_checkpoint, self.alloc_checkpoint_size = desc, len (data)
+
+        for desc, data in reversed (segments):
+            stream = io.BytesIO (data)
+            stream.seek (len (alloc_segment_magic) + alloc_segment_header.size)
+            self.alloc_state.JournalReplay (stream)
+            self.alloc_segments.append (desc)
+            self.alloc_journal_size += len (data)
+
+    def alloc_checkpoint_flush (self):
+        """Save full allocator state and release journal segments"""
+        for desc in self.alloc_segments:
+            self.Free (desc)
+        self.alloc_segments, self.alloc_journal_size = [], 0
+
+        while True:
+            state = io.BytesIO ()
+            self.alloc.Save (state)
+            desc = self.Push (state.getvalue (), self.alloc_checkpoint)
+            if desc == self.alloc_checkpoint:
+                break
+            self.alloc_checkpoint = desc
+        self.alloc.JournalClear ()
+
+        self.alloc_desc, self.alloc_checkpoint_size = desc, len (state.getvalue ())
+
+    def alloc_segment_flush (self):
+        """Save allocator journal as a new segment"""
+        desc = None
+        while True:
+            segment = io.BytesIO ()
+            segment.write (alloc_segment_magic)
+            segment.write (alloc_segment_header.pack (self.alloc_desc))
+            self.alloc.JournalSave (segment)
+            segment_desc = self.Push (segment.getvalue (), desc)
+            if segment_desc == desc:
+                break
+            desc = segment_desc
+        self.alloc.JournalClear ()
+
+        self.alloc_segments.append (desc)
+        self.alloc_journal_size += len (segment.getvalue ())
+        self.alloc_desc = desc
+
 # vim: nu ft=python columns=120 :
@@ -96,10 +96,16 @@ class StreamSack (Sack):
         desc: data's descriptor
         returns: data
         """
-        offset, order = desc >> 8, desc & 0xff
-        self.stream.seek (self.data_offset + offset)
-        self.alloc.Free (offset, order)
-        return self.stream.read (self.data_header.unpack (self.stream.read (self.data_header.size)) [0])
+        data = self.Get (desc)
+        self.alloc.Free (desc >> 8, desc & 0xff) # desc.offset, desc.order
+        return data
+
+    def Free (self, desc):
+        """Free data without reading it
+
+        desc: data's descriptor
+        """
+        self.alloc.Free (desc >> 8, desc & 0xff) # desc.offset, desc.order
 
     #--------------------------------------------------------------------------#
     # Flush                                                                    #
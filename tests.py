@@ -1,12 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import io
+import os
+import sys
+import shutil
+import tempfile
+import threading
 import unittest
 
 from .bptree import BPTree
 from .sack.stream import StreamSack
+from .sack.pfile import PFileSack
+from .sack.mmap import MMapSack
+from .udb import Table
+from .keys import KeyPack, KeyUnpack, KeyPrefixRange, KeyTable
+from .utils import BytesList, BytesPack, BytesPrefixSave, BytesPrefixLoad, BytesPrefixUnpack
 from .providers.simple import SimpleProvider
-from .providers.sack import SackProvider
+from .providers.sack import SackProvider, FLAG_COMPRESSION, FLAG_PAGE_TABLE, FLAG_PREFIX, FLAG_COUNTS, ZlibCodec
+from .providers.sack.codec import ZlibDictCodec, LzmaCodec
+from .providers.sack.bytes import OverflowDesc
+from .sack.page import PageTable
+from .sack.alloc import BuddyAllocator, AllocatorError
 
 from random import shuffle
 #------------------------------------------------------------------------------#
@@ -38,6 +52,38 @@ class TestSack (unittest.TestCase):
             self.assertNotEqual (d2_new, d2)
             self.assertEqual (sack.Push (b'abc', d1), d1)
 
+    @unittest.skipUnless (hasattr (os, 'pread'), 'Positional I/O is not supported')
+    def test_PFileSack (self):
+        directory = tempfile.mkdtemp ()
+        try:
+            path = os.path.join (directory, 'sack')
+            with PFileSack (path, 'n', 16) as sack:
+                descs = [(sack.Push (str (index).encode () * index), index) for index in range (512)]
+                sack.Cell [0] = b'cell'
+
+            with PFileSack (path, 'r', read_size = 64) as sack:
+                self.assertEqual (sack.Cell [0], b'cell')
+
+                # concurrent readers
+                errors = []
+                def reader ():
+                    for desc, index in descs:
+                        if sack.Get (desc) != str (index).encode () * index:
+                            errors.append (index)
+                threads = [threading.Thread (target = reader) for index in range (4)]
+                for thread in threads:
+                    thread.start ()
+                for thread in threads:
+                    thread.join ()
+                self.assertEqual (errors, [])
+
+            with PFileSack (path, 'w') as sack:
+                desc, index = descs [100]
+                self.assertEqual (sack.Pop (desc), str (index).encode () * index)
+                self.assertEqual (sack.Get (sack.Push (b'test', descs [1][0])), b'test')
+        finally:
+            shutil.rmtree (directory)
+
     def test_Cell (self):
         stream = io.BytesIO ()
         with StreamSack (stream, 10, 32, True) as sack:
@@ -59,6 +105,160 @@ class TestSack (unittest.TestCase):
         with StreamSack (stream, 10) as sack:
             self.assertEqual (len (sack.Cell.array), 0)
 
+    def test_Alloc (self):
+        alloc = BuddyAllocator (16)
+        blocks = [alloc.Alloc (size) for size in range (1, 256)]
+        self.assertEqual (alloc.UsedSpace, sum (1 << order for offset, order in blocks))
+        self.assertEqual (blocks [:3], [(0, 0), (2, 1), (4, 2)]) # lowest offset first
+
+        # blocks do not overlap
+        used = set ()
+        for offset, order in blocks:
+            block = set (range (offset, offset + (1 << order)))
+            self.assertFalse (used & block)
+            used |= block
+        self.assertTrue (alloc.IsAddressUsed (4) and not alloc.IsAddressUsed ((1 << 16) - 1))
+
+        # save | load
+        shuffle (blocks)
+        for offset, order in blocks [:128]:
+            alloc.Free (offset, order)
+        stream = io.BytesIO ()
+        alloc.Save (stream)
+        stream.seek (0)
+        alloc = BuddyAllocator.Load (stream)
+
+        # free everything and merge back
+        for offset, order in blocks [128:]:
+            alloc.Free (offset, order)
+        self.assertEqual (alloc.UsedSpace, 0)
+        self.assertEqual (alloc.Alloc (1 << 16), (0, 16))
+
+        # grow
+        self.assertEqual (alloc.Alloc (1), (1 << 16, 0))
+        self.assertEqual (alloc.order, 17)
+        self.assertEqual (alloc.Alloc (1 << 18), (1 << 18, 18))
+        self.assertEqual (alloc.order, 19)
+        alloc.Free (0, 16)
+        self.assertEqual (alloc.UsedSpace, (1 << 18) + 1)
+        self.assertRaises (AllocatorError, alloc.Alloc, 1 << 57)
+
+    def test_Grow (self):
+        stream = io.BytesIO ()
+        with StreamSack (stream, 10, 8, True) as sack: # 256 bytes sack
+            descs = [(sack.Push (str (index).encode () * 16), index) for index in range (64)]
+
+        with StreamSack (stream, 10) as sack:
+            self.assertTrue (sack.alloc.order > 8)
+            for desc, index in descs:
+                self.assertEqual (sack.Get (desc), str (index).encode () * 16)
+
+    def test_AllocJournal (self):
+        stream = io.BytesIO ()
+        with StreamSack (stream, 10, 16, True) as sack:
+            descs = [sack.Push (b'data' * index) for index in range (256)]
+        alloc_map, checkpoint_desc = sack.alloc.map, sack.alloc_desc
+
+        for step in range (128):
+            with StreamSack (stream, 10) as sack:
+                self.assertEqual (sack.alloc.map, alloc_map)
+                descs [step] = sack.Push (b'new data' * step, descs [step])
+                sack.Pop (descs [255 - step])
+                alloc_map = sack.alloc.map
+            if step == 0:
+                # only journal segment is written
+                self.assertEqual (sack.alloc_segments, [sack.alloc_desc])
+                self.assertEqual (sack.alloc_checkpoint, checkpoint_desc)
+
+        with StreamSack (stream, 10) as sack:
+            self.assertEqual (sack.alloc.map, alloc_map)
+            self.assertTrue (len (sack.alloc_segments) < 64)
+            for step in range (128):
+                self.assertEqual (sack.Get (descs [step]), b'new data' * step)
+
+    def test_PageTable (self):
+        stream = io.BytesIO ()
+        with StreamSack (stream, 10, 32, True) as sack:
+            pages = PageTable (sack)
+            idents = [pages.Alloc () for index in range (1024)]
+            self.assertEqual (idents, list (range (1, 1025)))
+            for ident in idents:
+                pages.Set (ident, sack.Push (str (ident).encode ()))
+            desc = pages.Get (idents [10])
+            self.assertEqual (pages.Free (idents [10]), desc)
+            sack.Pop (desc)
+            sack.Cell [0] = str (pages.Flush ()).encode ()
+
+        with StreamSack (stream, 10) as sack:
+            pages = PageTable (sack, int (sack.Cell [0]))
+            self.assertEqual (len (pages), 1024)
+            self.assertEqual (sack.Get (pages.Get (1000)), b'1000')
+            self.assertEqual (pages.Get (idents [10]), None)
+
+            # freed identifiers are reused
+            self.assertEqual (pages.Alloc (), idents [10])
+            self.assertEqual (pages.Alloc (), 1025)
+
+#------------------------------------------------------------------------------#
+# Utils                                                                        #
+#------------------------------------------------------------------------------#
+class TestUtils (unittest.TestCase):
+    def test_BytesPack (self):
+        items = [b'a', b'bc', None, b'', b'def']
+        pack = BytesPack (items)
+        self.assertEqual (list (pack), items)
+        self.assertEqual ((len (pack), pack [-1], pack [2], pack [1:4].offsets.tolist ()), (5, b'def', None, [1, 3, 3, 3]))
+        self.assertRaises (IndexError, lambda: pack [5])
+
+        # slices share buffer
+        chunk = pack [1:4]
+        self.assertEqual ((list (chunk), list (chunk [1:]), chunk.buffer is pack.buffer),
+            (items [1:4], items [2:4], True))
+        stream = io.BytesIO ()
+        chunk.Save (stream)
+        self.assertEqual ((list (BytesPack.Load (io.BytesIO (stream.getvalue ()))), list (chunk), chunk.buffer),
+            (items [1:4], items [1:4], b'bc'))
+
+        # modify
+        pack.insert (0, b'x')
+        pack.append (None)
+        pack [1] = b'aaa'
+        del pack [3]
+        self.assertEqual (pack.pop (), None)
+        self.assertEqual (pack.pop (0), b'x')
+        pack.extend (BytesPack ([None, b'z']))
+        del pack [1:2]
+        items = [b'aaa', b'', b'def', None, b'z']
+        self.assertEqual (list (pack), items)
+
+        # serialized format is compatible with bytes list
+        stream = io.BytesIO ()
+        pack.Save (stream)
+        self.assertEqual (BytesList.Load (io.BytesIO (stream.getvalue ())), items)
+        self.assertEqual (list (BytesPack.Load (io.BytesIO (stream.getvalue ()))), items)
+
+        # shared view, unpacked on modification and packed back on save
+        data = b'prefix' + stream.getvalue ()
+        view, end = BytesPack.View (data, 6)
+        self.assertEqual ((list (view), end, view.buffer is data), (items, len (data), True))
+        view [0] = b'b'
+        self.assertEqual ((list (view), view.buffer), ([b'b'] + items [1:], None))
+
+        view.Save (io.BytesIO ())
+        self.assertEqual ((list (view), view.items, view.buffer), ([b'b'] + items [1:], None, b'bdefz'))
+
+    def test_BytesPrefix (self):
+        items = [b'', b'a', b'abc', b'abd', b'abd\x00', b'b', b'b' * 100, b'b' * 101 + b'c']
+        stream = io.BytesIO ()
+        BytesPrefixSave (stream, items)
+        stream.write (b'tail')
+        self.assertEqual (len (stream.getvalue ()), 4 + 8 * len (items) + sum ((0, 1, 2, 1, 1, 1, 99, 2)) + 4)
+
+        stream.seek (0)
+        self.assertEqual ((BytesPrefixLoad (stream), stream.read ()), (items, b'tail'))
+        data = b'head' + stream.getvalue ()
+        self.assertEqual (BytesPrefixUnpack (data, 4), (items, len (data) - 4))
+
 #------------------------------------------------------------------------------#
 # B+Tree                                                                       #
 #------------------------------------------------------------------------------#
@@ -143,11 +343,319 @@ class BPTreeTest (unittest.TestCase):
         self.assertEqual (len (tree), 0)
         validate (tree)
 
+    def test_AddMany (self):
+        provider = self.provider ()
+        tree, std = BPTree (provider), {}
+
+        # batches of clustered and scattered keys
+        keys = list (range (1 << 10))
+        shuffle (keys)
+        batches = [sorted (keys [:300]), keys [300:310], keys [310:], keys [:500]]
+        for batch in batches:
+            items = [(key, str (key * len (batch))) for key in batch]
+            added = len (set (batch) - set (std))
+            self.assertEqual (tree.AddMany (items), added)
+            std.update (items)
+
+            provider = self.provider (provider)
+            tree = BPTree (provider)
+            self.assertEqual (len (tree), len (std))
+            self.assertEqual (list (tree.items ()), sorted (std.items ()))
+
+        # duplicates, last value wins
+        self.assertEqual (tree.AddMany ([(-1, 'a'), (-1, 'b')]), 1)
+        self.assertEqual (tree [-1], 'b')
+        self.assertEqual (tree.AddMany ({}), 0)
+
+        # deletion still works
+        for key in keys:
+            del tree [key]
+        self.assertEqual (list (tree.items ()), [(-1, 'b')])
+
+    def test_GetMany (self):
+        provider = self.provider ()
+        tree = BPTree (provider)
+        for key in range (0, 1 << 10, 2):
+            tree [key] = str (key)
+
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+
+        keys = list (range (-10, (1 << 10) + 10))
+        shuffle (keys)
+        self.assertEqual (tree.GetMany (keys), [str (key) if key % 2 == 0 and 0 <= key < 1 << 10 else None
+            for key in keys])
+        self.assertEqual (tree.GetMany (iter ([4, 3, 4]), '-'), ['4', '-', '4'])
+        self.assertEqual (tree.GetMany ([]), [])
+
+    def test_BulkLoad (self):
+        provider = self.provider ()
+        tree = BPTree (provider)
+
+        count = 1 << 10
+        self.assertEqual (tree.BulkLoad ((i, str (i)) for i in range (0, count, 2)), count >> 1)
+        self.assertRaises (ValueError, tree.BulkLoad, [(1, '1')])
+
+        # reload
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+        self.assertEqual (len (tree), count >> 1)
+        self.assertEqual (list (tree.items ()), [(i, str (i)) for i in range (0, count, 2)])
+
+        # tree remains mutable
+        for i in range (1, count, 2):
+            tree [i] = str (i)
+        self.assertEqual (list (tree.items ()), [(i, str (i)) for i in range (count)])
+        for i in range (0, count, 3):
+            del tree [i]
+        self.assertEqual (list (tree), [i for i in range (count) if i % 3])
+
+        # unsorted input
+        tree = BPTree (self.provider ())
+        self.assertRaises (ValueError, tree.BulkLoad, [(2, '2'), (1, '1')])
+        self.assertEqual (len (tree), 0)
+        self.assertEqual (tree.BulkLoad ([(1, '1')], fill = .5), 1)
+        self.assertEqual (list (tree.items ()), [(1, '1')])
+
+    def test_Update (self):
+        provider = self.provider ()
+        tree = BPTree (provider)
+
+        # counters
+        keys = list (range (1 << 9)) * 3
+        shuffle (keys)
+        for key in keys:
+            tree.Update (key, lambda value: value + 1, 0)
+        self.assertEqual (list (tree.items ()), [(key, 3) for key in range (1 << 9)])
+        self.assertEqual (tree.Update (1, lambda value: value * 2), 6)
+        self.assertRaises (KeyError, tree.Update, -1, lambda value: value)
+        self.assertEqual (tree.Merge (1, 4, 'add'), 10)
+        self.assertEqual (tree.Merge (-1, 4, 'max'), 4)
+        self.assertRaises (ValueError, tree.Merge, -1, 4, 'unknown')
+
+        # set default and compare and set
+        self.assertEqual (tree.SetDefault (2, 7), 3)
+        self.assertEqual (tree.SetDefault (-2, 7), 7)
+        self.assertFalse (tree.CompareAndSet (2, 4, 5))
+        self.assertTrue (tree.CompareAndSet (2, 3, 5))
+        self.assertFalse (tree.CompareAndSet (-3, 3, 5))
+        self.assertTrue (tree.CompareAndSet (-3, None, 5))
+        self.assertEqual ([tree [key] for key in (-3, -2, -1, 1, 2)], [5, 7, 4, 10, 5])
+
+        # reload
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+        self.assertEqual (len (tree), (1 << 9) + 3)
+        self.assertEqual (tree [1], 10)
+
+    def test_DeleteRange (self):
+        count = 1 << 10
+        ranges = [(100, 900), (None, 50), (950, None), (300.5, 301.5), (600, 601), (700, 700), (500, 400), (0, 2000)]
+        for low, high in ranges:
+            provider = self.provider ()
+            tree = BPTree (provider)
+            tree.AddMany ((key, str (key)) for key in range (count))
+            provider = self.provider (provider)
+            tree = BPTree (provider)
+
+            keys = [key for key in range (count) if (low is not None and key < low) or
+                (high is not None and key > high) or (low is not None and high is not None and low > high)]
+            self.assertEqual (tree.DeleteRange (low, high), count - len (keys))
+            self.assertEqual (len (tree), len (keys))
+            self.assertEqual (list (tree), keys)
+
+            # leafs are linked in both directions
+            leaf, keys_reversed = provider.Root (), []
+            for depth in range (provider.Depth () - 1):
+                leaf = provider.DescToNode (leaf.children [-1])
+            while leaf is not None:
+                keys_reversed.extend (reversed (list (leaf.keys)))
+                leaf = provider.DescToNode (leaf.prev)
+            self.assertEqual (keys_reversed, keys [::-1])
+
+            # tree remains balanced and mutable
+            for node in provider:
+                if node is not provider.Root ():
+                    self.assertTrue (len (node.keys) >= provider.Order () >> 1)
+            for key in range (0, count, 3):
+                tree [key] = str (key)
+            keys = sorted (set (keys) | set (range (0, count, 3)))
+            self.assertEqual (list (tree), keys)
+
+            provider = self.provider (provider)
+            tree = BPTree (provider)
+            self.assertEqual (list (tree), keys)
+            for key in keys:
+                del tree [key]
+            self.assertEqual (len (tree), 0)
+
+        # whole tree
+        tree = BPTree (self.provider ())
+        tree.AddMany ((key, str (key)) for key in range (count))
+        self.assertEqual (tree.DeleteRange (), count)
+        self.assertEqual (list (tree), [])
+        tree [1] = '1'
+        self.assertEqual (list (tree.items ()), [(1, '1')])
+
+    def test_GetRangeOffset (self):
+        provider = self.provider ()
+        tree = BPTree (provider)
+        tree.AddMany ((key, str (key)) for key in range (0, 1 << 10, 2))
+
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+
+        items = [(key, str (key)) for key in range (0, 1 << 10, 2)]
+        self.assertEqual (list (tree.GetRange (offset = 10, limit = 5)), items [10:15])
+        self.assertEqual (list (tree.GetRange (101, 201, offset = 3)), items [54:101])
+        self.assertEqual (list (tree.GetRange (101, offset = 3, limit = 2)), items [54:56])
+        self.assertEqual (list (tree.GetRange (offset = 1 << 10)), [])
+        self.assertEqual (list (tree.GetRange (limit = 0)), [])
+        self.assertEqual (list (tree.GetRange (1 << 10, offset = 1)), [])
+        if not provider.Counted ():
+            self.assertRaises (ValueError, tree.Rank, 0)
+
+    def test_GetRangeReverse (self):
+        provider = self.provider ()
+        tree = BPTree (provider)
+        self.assertEqual (list (tree.GetRange (high = 1, reverse = True)), [])
+        tree.AddMany ((key, str (key)) for key in range (0, 1 << 10, 2))
+
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+
+        items = [(key, str (key)) for key in range (0, 1 << 10, 2)]
+        self.assertEqual (list (tree.GetRange (reverse = True)), items [::-1])
+        self.assertEqual (list (tree.GetRange (101, 201, reverse = True)), items [51:101][::-1])
+        self.assertEqual (list (tree.GetRange (101, 201, offset = 3, reverse = True)), items [51:98][::-1])
+        self.assertEqual (list (tree.GetRange (high = 500, reverse = True, limit = 3)), items [248:251][::-1])
+        self.assertEqual (list (tree.GetRange (high = 500, reverse = True, limit = 2, inclusive = (True, False))),
+            items [248:250][::-1])
+        self.assertEqual (list (tree.GetRange (1 << 10, reverse = True)), [])
+
+        # bounds
+        self.assertEqual (list (tree.GetRange (100, 104, inclusive = (False, False))), [(102, '102')])
+        self.assertEqual (list (tree.GetRange (100, 104, reverse = True, inclusive = (False, True))),
+            [(104, '104'), (102, '102')])
+        self.assertEqual (list (tree.GetRange (100, 100)), [(100, '100')])
+        self.assertEqual (list (tree.GetRange (100, 100, inclusive = (True, False))), [])
+        self.assertEqual (list (tree.GetRange (high = 0)), [(0, '0')])
+
+        # reversed cursor
+        self.assertEqual (list (reversed (tree.GetCursor (20))), items [:10][::-1])
+
+    def test_Append (self):
+        count = 1 << 10
+        for keys, batch in ((range (count), 1), (range (count, 0, -1), 1), (range (count), 16),
+                            (range (count, 0, -1), 16)):
+            provider = self.provider ()
+            tree, keys = BPTree (provider), list (keys)
+            for index in range (0, count, batch):
+                if batch == 1:
+                    tree [keys [index]] = str (keys [index])
+                else:
+                    tree.AddMany ((key, str (key)) for key in keys [index:index + batch])
+            provider = self.provider (provider)
+            tree = BPTree (provider)
+            self.assertEqual (list (tree), sorted (keys))
+
+            # nodes left behind by appends are filled up to 5 of 6 keys
+            leafs = [node for node in provider if node.is_leaf]
+            self.assertTrue (len (leafs) <= count // 5 + 1)
+            for key in keys:
+                del tree [key]
+            self.assertEqual (len (tree), 0)
+
     def provider (self, source = None):
         if source is None:
             return SimpleProvider (order = 7)
         return source
 
+#------------------------------------------------------------------------------#
+# B+Tree with Subtree Counts                                                   #
+#------------------------------------------------------------------------------#
+class BPTreeCountsTest (BPTreeTest):
+    def test_Counts (self):
+        provider = self.provider ()
+        tree, keys = BPTree (provider), set ()
+
+        def validate (tree):
+            def count (node):
+                if node.is_leaf:
+                    return len (node.keys)
+                counts = [count (tree.provider.DescToNode (desc)) for desc in node.children]
+                self.assertEqual (list (node.counts), counts)
+                return sum (counts)
+            self.assertEqual (count (tree.provider.Root ()), len (keys))
+
+            std = sorted (keys)
+            for index in range (0, len (std), 7):
+                self.assertEqual (tree.Select (index), (std [index], str (std [index])))
+                self.assertEqual (tree.Rank (std [index]), index)
+                self.assertEqual (tree.Rank (std [index] + .5), index + 1)
+            if std:
+                self.assertEqual (tree.Select (-1), (std [-1], str (std [-1])))
+            self.assertRaises (IndexError, tree.Select, len (std))
+            self.assertEqual (tree.CountRange (), len (std))
+            self.assertEqual (tree.CountRange (100, 300.5), len ([key for key in std if 100 <= key <= 300.5]))
+            self.assertEqual (tree.CountRange (high = 100), len ([key for key in std if key <= 100]))
+            self.assertEqual (tree.CountRange (300, 100), 0)
+
+        # bulk load
+        tree.BulkLoad ((key, str (key)) for key in range (0, 1 << 10, 3))
+        keys.update (range (0, 1 << 10, 3))
+        validate (tree)
+
+        # add, add many, pop
+        ops = list (range (1 << 10))
+        shuffle (ops)
+        for key in ops [:300]:
+            tree [key] = str (key)
+            keys.add (key)
+        validate (tree)
+        tree.AddMany ((key, str (key)) for key in ops [300:600])
+        keys.update (ops [300:600])
+        validate (tree)
+
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+        validate (tree)
+
+        shuffle (ops)
+        for key in ops [:800]:
+            if key in keys:
+                tree.pop (key)
+                keys.discard (key)
+        validate (tree)
+
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+        validate (tree)
+
+        # delete range
+        removed = set (key for key in keys if 200 <= key <= 700)
+        self.assertEqual (tree.DeleteRange (200, 700), len (removed))
+        keys -= removed
+        validate (tree)
+
+        for key in list (keys):
+            del tree [key]
+            keys.discard (key)
+        validate (tree)
+
+    def provider (self, source = None):
+        if source is None:
+            return SimpleProvider (order = 7, counted = True)
+        return source
+
+class BPTreeSackCountsTest (BPTreeCountsTest):
+    def provider (self, source = None):
+        if source is None:
+            return SackProvider (StreamSack (io.BytesIO (), order = 32, new = True, readonly = False), order = 7,
+                type = 'PP', flags = FLAG_COUNTS, cache_size = 2)
+        source.Flush ()
+        return SackProvider (StreamSack (source.sack.stream, source.sack.offset), cache_size = 2)
+
 #------------------------------------------------------------------------------#
 # B+Tree with Sack Provider                                                    #
 #------------------------------------------------------------------------------#
@@ -158,4 +666,457 @@ class BPTreeSackTest (BPTreeTest):
         source.Flush ()
         return SackProvider (StreamSack (source.sack.stream, source.sack.offset))
 
+#------------------------------------------------------------------------------#
+# B+Tree with Sack Provider and Bounded Cache                                  #
+#------------------------------------------------------------------------------#
+class BPTreeSackCacheTest (BPTreeTest):
+    def test_CacheStats (self):
+        provider = self.provider ()
+        tree = BPTree (provider)
+        for key in range (1 << 10):
+            tree [key] = str (key)
+
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+        self.assertEqual (list (tree), list (range (1 << 10)))
+
+        stats = provider.CacheStats
+        self.assertTrue (stats ['size'] <= 2)
+        self.assertTrue (stats ['misses'] > 0)
+        self.assertTrue (stats ['evictions'] > 0)
+
+    def test_GetRangeLimit (self):
+        provider = self.provider ()
+        tree = BPTree (provider)
+        tree.AddMany ((key, str (key)) for key in range (1 << 10))
+
+        # leafs past the limit are not loaded
+        provider = self.provider (provider)
+        tree = BPTree (provider)
+        self.assertEqual (list (tree.GetRange (high = 500, reverse = True, limit = 1)), [(500, '500')])
+        self.assertTrue (provider.CacheStats ['misses'] < provider.Depth ())
+
+    def provider (self, source = None):
+        if source is None:
+            return SackProvider (StreamSack (io.BytesIO (), order = 32, new = True, readonly = False), order = 7,
+                type = 'PP', cache_size = 2)
+        source.Flush ()
+        return SackProvider (StreamSack (source.sack.stream, source.sack.offset), cache_size = 2)
+
+
+#------------------------------------------------------------------------------#
+# B+Tree with Sack Provider and Page Table                                     #
+#------------------------------------------------------------------------------#
+class BPTreeSackPageTest (BPTreeTest):
+    def provider (self, source = None):
+        if source is None:
+            return SackProvider (StreamSack (io.BytesIO (), order = 32, new = True, readonly = False), order = 7,
+                type = 'PP', flags = FLAG_PAGE_TABLE, cache_size = 2)
+        source.Flush ()
+        return SackProvider (StreamSack (source.sack.stream, source.sack.offset), cache_size = 2)
+
+
+#------------------------------------------------------------------------------#
+# Table                                                                        #
+#------------------------------------------------------------------------------#
+class TableTest (unittest.TestCase):
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+        self.path = os.path.join (self.directory, 'table')
+        open (self.path, 'wb').close ()
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def test_MMapView (self):
+        items = [(str (key).encode (), str (key).encode () * 3) for key in range (1 << 10)]
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            with Table (sack, 0, order = 16) as table:
+                table.AddMany (items)
+                table [b'none'] = None
+
+        with MMapSack (self.path, 'r') as sack:
+            table = Table (sack, 0)
+            self.assertEqual (table [b'512'], b'512512512')
+            leaf = table.provider.Root ()
+            while not leaf.is_leaf:
+                leaf = table.provider.DescToNode (leaf.children [0])
+            self.assertTrue (isinstance (leaf.keys, BytesPack))
+            self.assertTrue (leaf.keys.buffer is sack.stream) # nothing is copied
+            self.assertEqual (table [b'none'], None)
+
+        with MMapSack (self.path, 'w') as sack:
+            with Table (sack, 0) as table:
+                for key, value in items [::2]:
+                    del table [key]
+                table [b'new'] = b'value'
+
+        with MMapSack (self.path, 'r') as sack:
+            table = Table (sack, 0)
+            self.assertEqual (list (table.items ()), sorted (items [1::2] + [(b'new', b'value'), (b'none', None)]))
+
+        # relocated leaf must not keep viewing its old (reused) block
+        items = sorted (items [1::2] + [(b'new', b'value'), (b'none', None)])
+        with MMapSack (self.path, 'w') as sack:
+            with Table (sack, 0) as table:
+                table [items [0][0]] = b'X' * 3000
+                table.Flush ()
+                for key in range (1 << 10, 1 << 11):
+                    table [str (key).encode ()] = b'Y' * 3000
+                table.Flush ()
+                self.assertEqual (table [items [0][0]], b'X' * 3000)
+                for key, value in items [1:]:
+                    self.assertEqual (table [key], value)
+
+    def test_ReadOnlyOpen (self):
+        items = [(str (key).encode (), str (key).encode ()) for key in range (1 << 10)]
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            with Table (sack, 0, order = 16) as table:
+                table.AddMany (items)
+
+        # lookups do not load allocator
+        for sack_type in [MMapSack] + ([PFileSack] if hasattr (os, 'pread') else []):
+            with sack_type (self.path, 'r') as sack:
+                table = Table (sack, 0)
+                self.assertEqual (table [b'512'], b'512')
+                self.assertEqual (len (list (table.items ())), len (items))
+                self.assertIsNone (sack.alloc_state)
+
+    def test_NumericTypes (self):
+        keys = list (range (1 << 10))
+        shuffle (keys)
+        for type, value in (('QQ', lambda key: key << 20), ('QS', lambda key: str (key).encode ()),
+                            ('qd', lambda key: key / 3.0)):
+            for flags in (0, FLAG_COMPRESSION):
+                with MMapSack (self.path, 'n', order = 16) as sack:
+                    with Table (sack, 0, order = 16, type = type, flags = flags) as table:
+                        for key in keys:
+                            table [key] = value (key)
+                        table.Flush ()
+                        for key in keys [::2]:
+                            del table [key]
+
+                with MMapSack (self.path, 'r') as sack:
+                    table = Table (sack, 0)
+                    self.assertEqual (list (table.items ()), [(key, value (key)) for key in sorted (keys [1::2])])
+
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            self.assertRaises (TypeError, Table, sack, 0, 16, 'Qx')
+
+    def test_Prefix (self):
+        items = [('tenant/{}/object/{}'.format (key % 3, key).encode (), str (key).encode ()) for key in range (1 << 10)]
+        for flags in (FLAG_PREFIX, FLAG_PREFIX | FLAG_COMPRESSION):
+            with MMapSack (self.path, 'n', order = 16) as sack:
+                with Table (sack, 0, order = 16, flags = flags) as table:
+                    table.AddMany (items)
+                    table.Flush ()
+                    for key, value in items [::2]:
+                        del table [key]
+
+            with MMapSack (self.path, 'r') as sack:
+                table = Table (sack, 0)
+                self.assertEqual (list (table.items ()), sorted (items [1::2]))
+                self.assertEqual (table [items [1][0]], items [1][1])
+
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            self.assertRaises (ValueError, Table, sack, 0, 16, 'PP', FLAG_PREFIX)
+
+    def test_BulkLoad (self):
+        items = [('{:06}'.format (key).encode (), str (key).encode () * (300 if key % 64 == 0 else 4))
+            for key in range (1 << 13)]
+        for options in ({}, {'flags': FLAG_PAGE_TABLE}, {'flags': FLAG_PREFIX | FLAG_COUNTS}, {'codec': 'zdict'},
+                        {'overflow': 256}):
+            with MMapSack (self.path, 'n', order = 16) as sack:
+                with Table (sack, 0, order = 16, **options) as table:
+                    self.assertEqual (table.BulkLoad (iter (items)), len (items))
+                    # nodes are written while loading, only the root is kept in memory
+                    self.assertEqual ((list (table.provider.d2n.values ()), list (table.provider.dirty)),
+                        ([table.provider.Root ()], [table.provider.Root ()]))
+                    self.assertEqual (table [items [100][0]], items [100][1])
+
+            with MMapSack (self.path, 'w') as sack:
+                with Table (sack, 0) as table:
+                    self.assertEqual (list (table.items ()), items)
+                    self.assertEqual (list (table.GetRange (reverse = True)), items [::-1]) # leafs are linked
+                    for key, value in items [::3]:
+                        del table [key]
+                    table [b'new'] = b'value'
+
+            with MMapSack (self.path, 'r') as sack:
+                table = Table (sack, 0)
+                self.assertEqual (list (table.items ()), [item for index, item in enumerate (items) if index % 3] +
+                    [(b'new', b'value')])
+                if options.get ('codec'):
+                    self.assertEqual (bool (table.provider.codec.Dictionary), ZlibDictCodec.supported)
+
+    def test_Separators (self):
+        items = [('tenant/{:04}/object/{}'.format (key, 'x' * 32).encode (), str (key).encode ()) for key in range (1 << 10)]
+        shuffle (items)
+
+        def validate (table, std):
+            self.assertEqual (list (table.items ()), sorted (std.items ()))
+            def check (node, low, high):
+                for key in node.keys:
+                    self.assertTrue ((low is None or low <= key) and (high is None or key < high))
+                if node.is_leaf:
+                    return
+                self.assertTrue (all (len (key) <= len ('tenant/0000') for key in node.keys))
+                bounds = [low] + list (node.keys) + [high]
+                for index, child in enumerate (node.children):
+                    check (table.provider.DescToNode (child), bounds [index], bounds [index + 1])
+            check (table.provider.Root (), None, None)
+
+        for fill in ('Add', 'AddMany', 'BulkLoad'):
+            with StreamSack (io.BytesIO (), order = 32, new = True, readonly = False) as sack:
+                table, std = Table (sack, 0, order = 8), dict (items)
+                if fill == 'Add':
+                    for key, value in items:
+                        table [key] = value
+                elif fill == 'AddMany':
+                    table.AddMany (items)
+                else:
+                    table.BulkLoad (sorted (items))
+                validate (table, std)
+
+                # redistribution
+                for key, value in items [::3]:
+                    del table [key], std [key]
+                validate (table, std)
+
+    def test_Codecs (self):
+        items = [('tenant/{}/object/{}'.format (key % 3, key).encode (), str (key).encode () * 8) for key in range (1 << 12)]
+        codecs = ['zlib', ZlibCodec (9), 'lzma', 'bz2', 'zdict']
+        if sys.version_info [0] < 3:
+            codecs.remove ('lzma') # not available on python 2
+        for codec in codecs:
+            with MMapSack (self.path, 'n', order = 16) as sack:
+                with Table (sack, 0, order = 64, codec = codec) as table:
+                    table.AddMany (items)
+                    table.Flush ()
+                    for key, value in items [::2]:
+                        del table [key]
+
+            with MMapSack (self.path, 'w') as sack:
+                table = Table (sack, 0)
+                self.assertEqual (list (table.items ()), sorted (items [1::2]))
+                if codec == 'zdict':
+                    self.assertEqual (bool (table.provider.codec.Dictionary), ZlibDictCodec.supported)
+                    table.Drop ()
+                    self.assertFalse (sack.Cell [0])
+
+        # dictionary is trained from samples collected across small flushes
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            with Table (sack, 0, order = 64, codec = 'zdict') as table:
+                for key in range (20000):
+                    table [str (key).encode ()] = str (key).encode () * 4
+                    if key % 100 == 99:
+                        table.Flush ()
+                self.assertEqual (bool (table.provider.codec.Dictionary), ZlibDictCodec.supported)
+                self.assertEqual (table.provider.codec_samples, [])
+        with MMapSack (self.path, 'r') as sack:
+            table = Table (sack, 0)
+            self.assertEqual (table [b'12345'], b'12345' * 4)
+            self.assertEqual (len (table), 20000)
+
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            self.assertRaises (ValueError, Table, sack, 0, codec = 'unknown')
+            self.assertRaises (ValueError, Table, sack, 0, flags = FLAG_COMPRESSION, codec = 'zlib')
+            self.assertRaises (ValueError, Table, sack, 0, codec = ZlibCodec (-2))
+
+        # level does not fit into a byte (lzma preset with PRESET_EXTREME flag)
+        if sys.version_info [0] >= 3:
+            import lzma
+            with MMapSack (self.path, 'n', order = 16) as sack:
+                with Table (sack, 0, order = 64, codec = LzmaCodec (6 | lzma.PRESET_EXTREME)) as table:
+                    table.AddMany (items)
+            with MMapSack (self.path, 'r') as sack:
+                table = Table (sack, 0)
+                self.assertEqual (table.provider.codec.level, 6 | lzma.PRESET_EXTREME)
+                self.assertEqual (list (table.items ()), sorted (items))
+
+    def test_Overflow (self):
+        large = lambda key: str (key).encode () * (1 << 12)
+        items = [(str (key).encode (), large (key) if key % 4 == 0 else str (key).encode ()) for key in range (1 << 8)]
+        for flags in (0, FLAG_PREFIX):
+            with StreamSack (io.BytesIO (), order = 16, new = True, readonly = False) as sack:
+                table = Table (sack, 0, order = 16, flags = flags, overflow = 1024)
+                used = sack.alloc.UsedSpace
+                table.AddMany (items)
+                table.Flush ()
+
+                # leafs only keep descriptors
+                first_leaf = lambda: table.GetCursor (b'0').leaf
+                leaf = first_leaf ()
+                overflow = set (child for child in list.__iter__ (leaf.children) if child.__class__ is OverflowDesc)
+                self.assertTrue (overflow and overflow == leaf.overflow)
+                self.assertTrue (len (sack.Get (leaf.desc)) < 1024)
+
+                # update of small value does not touch large ones
+                table [b'1'] = b'one'
+                table.Flush ()
+                self.assertEqual (first_leaf ().overflow, overflow)
+
+                # reload
+                table = Table (sack, 0)
+                self.assertEqual (list (table.items ()), sorted (items [:1] + [(b'1', b'one')] + items [2:]))
+
+                # update and delete of large values release them
+                table [b'0'] = b'zero'
+                for key, value in items [4::4]:
+                    table [key] = value + b'!'
+                table.Flush ()
+                self.assertEqual (table [b'4'], large (4) + b'!')
+                for key, value in items [1:]:
+                    del table [key]
+                table.Flush ()
+                self.assertEqual (list (table.items ()), [(b'0', b'zero')])
+                self.assertTrue (sack.alloc.UsedSpace < used + (1 << 14))
+
+                # drop releases values
+                for key, value in items [::4]:
+                    table [key] = value
+                table.Flush ()
+                self.assertTrue (sack.alloc.UsedSpace > used + (1 << 18))
+                table.Drop ()
+                self.assertTrue (sack.alloc.UsedSpace < used + (1 << 14))
+
+        with StreamSack (io.BytesIO (), order = 16, new = True, readonly = False) as sack:
+            self.assertRaises (ValueError, Table, sack, 0, 16, 'PP', overflow = 1024)
+
+    def test_Bloom (self):
+        items = [(str (key).encode (), str (key).encode ()) for key in range (0, 1 << 12, 2)]
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            with Table (sack, 0, order = 16, bloom = .01) as table:
+                for key, value in items [:1 << 10]:
+                    table [key] = value
+                table.AddMany (items [1 << 10:-2])
+                self.assertEqual (table.AddMany (dict (items [-2:])), 2)
+                self.assertTrue (table.BloomStats ['capacity'] >= len (items))
+
+        with MMapSack (self.path, 'w') as sack:
+            table = Table (sack, 0)
+            missing = [str (key).encode () for key in range (1, 1 << 12, 2)]
+            self.assertEqual ([table.get (key) for key in missing], [None] * len (missing))
+            self.assertEqual (table.GetMany (missing + [b'2']), [None] * len (missing) + [b'2'])
+            self.assertTrue (all (key in table for key, value in items))
+            self.assertRaises (KeyError, table.Get, b'1')
+
+            stats = table.BloomStats
+            self.assertEqual (stats ['hits'] - stats ['false_positives'], len (items) + 1)
+            self.assertTrue (stats ['skips'] > len (missing) * 2 * .95)
+
+            # deleted keys are dropped from filter by rebuild
+            for key, value in items [::2]:
+                del table [key]
+            self.assertEqual (table.BloomStats ['deletes'], len (items [::2]))
+            table.BloomRebuild ()
+            self.assertEqual (table.BloomStats ['deletes'], 0)
+            self.assertTrue (sum (key in table.provider.bloom for key, value in items [::2]) < len (items) * .05)
+            self.assertEqual (list (table.items ()), sorted (items [1::2]))
+            table.Drop ()
+
+    def test_DeleteRange (self):
+        items = [(str (key).encode ().zfill (5), str (key).encode () * (key % 7 * 20)) for key in range (1 << 12)]
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            with Table (sack, 0, order = 16, overflow = 64, bloom = .01) as table:
+                table.AddMany (items)
+            used = sack.alloc.UsedSpace
+
+            with Table (sack, 0) as table:
+                self.assertEqual (table.DeleteRange (b'00100', b'03999'), 3900)
+                self.assertEqual (table.BloomStats ['deletes'], 3900)
+                self.assertEqual (list (table.items ()), items [:100] + items [4000:])
+            self.assertTrue (sack.alloc.UsedSpace < used / 4)
+
+    def test_Merge (self):
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            with Table (sack, 0, order = 16, bloom = .01) as table:
+                table [b'a'] = b'1'
+                with table.WriteBatch () as batch:
+                    batch.Merge (b'a', b'2', 'add')
+                    batch.Merge (b'b', b'1', 'add')
+                    batch [b'c'] = b'1'
+                    batch.Merge (b'c', b'2', 'add')
+                    batch.Merge (b'b', b'2', lambda value, operand: value + operand * 2)
+                self.assertEqual (list (table.items ()), [(b'a', b'12'), (b'b', b'122'), (b'c', b'12')])
+
+                # keys added by update are added to bloom filter
+                self.assertEqual (table.SetDefault (b'd', b'1'), b'1')
+                self.assertEqual (table.Merge (b'e', b'1', 'min'), b'1')
+                self.assertTrue (table.CompareAndSet (b'f', None, b'1'))
+
+        with MMapSack (self.path, 'w') as sack:
+            table = Table (sack, 0)
+            self.assertEqual (table.GetMany ([b'd', b'e', b'f', b'g']), [b'1', b'1', b'1', None])
+
+    def test_Drop (self):
+        items = [(str (key).encode (), str (key).encode () * 8) for key in range (1 << 12)]
+        for flags in (0, FLAG_PAGE_TABLE):
+            with MMapSack (self.path, 'n', order = 16) as sack:
+                sack.Flush ()
+                used = sack.alloc.UsedSpace
+                with Table (sack, 0, order = 16, flags = flags, bloom = .01) as table:
+                    table.AddMany (items)
+
+                # leafs are not loaded and unflushed nodes are dropped as well
+                table = Table (sack, 0)
+                table.AddMany ((key + b'!', value) for key, value in items [::16])
+                provider, misses = table.provider, table.provider.CacheStats ['misses']
+                table.Drop ()
+                self.assertEqual (provider.CacheStats ['misses'], misses)
+                self.assertFalse (sack.Cell [0])
+                self.assertTrue (sack.alloc.UsedSpace < used + (1 << 14)) # allocator journal segments
+
+    def test_KeyTable (self):
+        items = [((tenant, stamp, str (stamp % 7)), str (stamp).encode ()) for tenant in (b'a', b'a\x00', b'b') for stamp in range (-64, 64)]
+        shuffle (items)
+        with MMapSack (self.path, 'n', order = 16) as sack:
+            with Table (sack, 0, order = 8) as table:
+                KeyTable (table).AddMany (items)
+
+        with MMapSack (self.path, 'r') as sack:
+            table = KeyTable (Table (sack, 0))
+            self.assertEqual (list (table.items ()), sorted (items))
+            self.assertEqual (table [b'b', 3, '3'], b'3')
+            self.assertEqual (list (table.GetPrefix ((b'a',))), sorted (item for item in items if item [0][0] == b'a'))
+            self.assertEqual (list (table.GetPrefix ((b'b', 10))), [((b'b', 10, '3'), b'10')])
+            self.assertEqual (list (table.GetPrefix ((b'a',), limit = 2, reverse = True)),
+                sorted (item for item in items if item [0][0] == b'a') [:-3:-1])
+            self.assertEqual (list (table.table.GetRange (*KeyPrefixRange ((b'a\x00', -64)))),
+                [(KeyPack ((b'a\x00', -64, '6')), b'-64')])
+
+        # mapping items
+        with MMapSack (self.path, 'w') as sack:
+            table = KeyTable (Table (sack, 0))
+            self.assertEqual (table.AddMany ({(b'c', b'x'): b'1', (b'c', b'y'): b'2'}), 2)
+            self.assertEqual (list (table.GetPrefix ((b'c',))), [((b'c', b'x'), b'1'), ((b'c', b'y'), b'2')])
+
+#------------------------------------------------------------------------------#
+# Keys                                                                         #
+#------------------------------------------------------------------------------#
+class KeysTest (unittest.TestCase):
+    def test_Order (self):
+        for keys in (
+            [0, -1, 1, 255, 256, -256, 1 << 64, -(1 << 64), 1 << 100, -(1 << 100)],
+            [float (key) / 7 for key in range (-100, 100)] + [float ('inf'), float ('-inf'), 1e300, -1e-300],
+            [b'', b'\x00', b'\x00\x00', b'\x00\xff', b'\x01', b'a', b'a\x00', b'ab', b'b'],
+            [u'', u'a', u'a\x00', u'\xe9', u'\u4e2d'],
+            [(), (None,), (None, 1), (1,), (1, None), (1, 2), (2,)],
+            [((),), ((None,),), ((1,),), ((1, None),), ((1, 2),), ((2,),)]):
+
+            packed = [KeyPack ((key, key)) for key in keys]
+            self.assertEqual ([KeyUnpack (data) for data in packed], [(key, key) for key in keys])
+            self.assertEqual (sorted (packed), [KeyPack ((key, key)) for key in sorted (keys, key = order_key)])
+
+        packed = [KeyPack ((key,)) for key in (None, b'', u'', (), -1, 0.0, False, True)]
+        self.assertEqual (sorted (packed), packed)
+        self.assertEqual (KeyUnpack (KeyPack (b'scalar')), (b'scalar',))
+        self.assertRaises (TypeError, KeyPack, object ())
+
+def order_key (key):
+    """Tuple order where None is less than anything"""
+    if isinstance (key, tuple):
+        return tuple ((item is not None, order_key (item)) for item in key)
+    return key
+
 # vim: nu ft=python columns=120 :
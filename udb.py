@@ -1,29 +1,150 @@
 # -*- coding: utf-8 -*-
-from .bptree import BPTree
+from .bptree import BPTree, null
 from .sack.file import FileSack
 from .providers import Provider
-from .providers.sack import SackProvider
+from .providers.sack import SackProvider, Bloom, FLAG_OVERFLOW
+from .merge import MergeOperator
 
 __all__ = ('uDB', 'xDB')
 #------------------------------------------------------------------------------#
 # Default Values                                                               #
 #------------------------------------------------------------------------------#
-default_sack_order    = 32
+default_sack_order    = 20 # initial order, sack grows on demand
 default_bptree_order  = 256
 default_type          = 'SS'
 default_cell          = 0
 
+missing = object () # marker of missing value
+
 #------------------------------------------------------------------------------#
 # Table                                                                        #
 #------------------------------------------------------------------------------#
 class Table (BPTree):
-    def __init__ (self, sack, cell, order = None, type = None, flags = None):
+    def __init__ (self, sack, cell, order = None, type = None, flags = None, cache_size = None, codec = None,
+        overflow = None, bloom = None):
         # init defaults
         type  = default_type if type is None else type
         order = default_bptree_order if order is None else order
 
         # base ctor
-        BPTree.__init__ (self, SackProvider (sack, order, type, cell, flags))
+        BPTree.__init__ (self, SackProvider (sack, order, type, cell, flags, cache_size, codec, overflow, bloom))
+
+    #--------------------------------------------------------------------------#
+    # Bloom Filter                                                             #
+    #--------------------------------------------------------------------------#
+    # Lookups of keys rejected by bloom filter do not touch the tree. Filter is
+    # rebuilt (with doubled capacity) once table size exceeds its capacity.
+
+    def Get (self, key, default = null):
+        bloom = self.provider.bloom
+        if bloom is None:
+            return BPTree.Get (self, key, default)
+
+        if bloom.Check (key):
+            value = BPTree.Get (self, key, missing)
+            if value is not missing:
+                return value
+            bloom.false_positives += 1
+        if default is null:
+            raise KeyError (key)
+        return default
+
+    def GetMany (self, keys, default = None):
+        bloom = self.provider.bloom
+        if bloom is None:
+            return BPTree.GetMany (self, keys, default)
+
+        keys = keys if isinstance (keys, list) else list (keys)
+        positions = [position for position, key in enumerate (keys) if bloom.Check (key)]
+        values = [default] * len (keys)
+        for position, value in zip (positions, BPTree.GetMany (self, [keys [position] for position in positions],
+            missing)):
+            if value is missing:
+                bloom.false_positives += 1
+            else:
+                values [position] = value
+        return values
+
+    def Add (self, key, value):
+        BPTree.Add (self, key, value)
+        if self.provider.bloom is not None:
+            self.bloom_add (key)
+
+    def update (self, key, function):
+        value, value_new = BPTree.update (self, key, function)
+        if value is null and value_new is not null and self.provider.bloom is not None:
+            self.bloom_add (key)
+        return value, value_new
+
+    def AddMany (self, items):
+        bloom = self.provider.bloom
+        if bloom is None:
+            return BPTree.AddMany (self, items)
+
+        if hasattr (items, 'items'):
+            items = items.items ()
+        items = items if isinstance (items, list) else list (items)
+        count = BPTree.AddMany (self, items)
+        for key, value in items:
+            bloom.Add (key)
+        if self.provider.Size () > bloom.capacity:
+            self.BloomRebuild ()
+        return count
+
+    def BulkLoad (self, items, fill = None):
+        bloom = self.provider.bloom
+        if bloom is None:
+            return BPTree.BulkLoad (self, items, fill)
+
+        def bloom_items ():
+            for key, value in items:
+                bloom.Add (key)
+                yield key, value
+        count = BPTree.BulkLoad (self, bloom_items (), fill)
+        if self.provider.Size () > bloom.capacity:
+            self.BloomRebuild ()
+        return count
+
+    def Pop (self, key, default = null):
+        size = self.provider.Size ()
+        value = BPTree.Pop (self, key, default)
+        if self.provider.bloom is not None and self.provider.Size () < size:
+            self.provider.bloom.Delete ()
+        return value
+
+    def DeleteRange (self, low = None, high = None):
+        count = BPTree.DeleteRange (self, low, high)
+        if self.provider.bloom is not None and count:
+            self.provider.bloom.Delete (count)
+        return count
+
+    def BloomRebuild (self, capacity = None):
+        """Rebuild bloom filter from table keys
+
+        Drops deleted keys from the filter, should be called after many Pops.
+
+        capacity: expected number of keys (twice the table size if None)
+        """
+        bloom = self.provider.bloom
+        if bloom is None:
+            raise ValueError ('Table has no bloom filter')
+
+        bloom_new = Bloom ((len (self) * 2 or None) if capacity is None else capacity, bloom.rate)
+        bloom_new.hits, bloom_new.skips, bloom_new.false_positives = bloom.hits, bloom.skips, bloom.false_positives
+        for key in self:
+            bloom_new.Add (key)
+        self.provider.bloom = bloom_new
+
+    @property
+    def BloomStats (self):
+        """Bloom filter statistics (None if table has no filter)"""
+        return None if self.provider.bloom is None else self.provider.bloom.Stats
+
+    def bloom_add (self, key):
+        bloom = self.provider.bloom
+        bloom.Add (key)
+        if self.provider.Size () > bloom.capacity:
+            self.BloomRebuild ()
 
     #--------------------------------------------------------------------------#
     # Flush                                                                    #
@@ -31,15 +152,39 @@ class Table (BPTree):
     def Flush (self):
         self.provider.Flush ()
 
+    #--------------------------------------------------------------------------#
+    # Write Batch                                                              #
+    #--------------------------------------------------------------------------#
+    def WriteBatch (self):
+        """Create write batch
+
+        Items added to the batch are applied with a single AddMany call
+        once the batch is committed (or its context is exited without error).
+        """
+        return WriteBatch (self)
+
     #--------------------------------------------------------------------------#
     # Drop                                                                     #
     #--------------------------------------------------------------------------#
     def Drop (self):
-        self.provider.Flush ()
-        for node in list (self.provider):
-            self.provider.sack.Pop (node.desc)
-        del self.provider.sack.Cell [self.provider.cell]
-        self.provider.sack.Flush ()
+        """Drop table and release its sack space
+
+        Table is not flushed beforehand and only internal nodes are loaded,
+        leafs are released by descriptors found in their parents (leafs of
+        table with out of line values are loaded to find their values).
+        """
+        provider = self.provider
+        provider.ReleaseTree (provider.NodeToDesc (provider.Root ()), provider.Depth ())
+        if provider.pages is not None:
+            provider.pages.Drop ()
+        if provider.codec_desc is not None:
+            provider.sack.Free (provider.codec_desc)
+        if provider.flags & FLAG_OVERFLOW:
+            provider.overflow_flush () # release out of line values of released leafs
+        if provider.bloom_desc is not None:
+            provider.sack.Free (provider.bloom_desc)
+        del provider.sack.Cell [provider.cell]
+        provider.sack.Flush ()
         self.provider = Provider () # set dummy provider
 
     #--------------------------------------------------------------------------#
@@ -56,12 +201,66 @@ class Table (BPTree):
             self.provider.Dispose ()
         return False
 
+#------------------------------------------------------------------------------#
+# Write Batch                                                                  #
+#------------------------------------------------------------------------------#
+class WriteBatch (object):
+    def __init__ (self, table):
+        self.table = table
+        self.items = []
+
+    def Add (self, key, value):
+        self.items.append ((key, value))
+
+    def __setitem__ (self, key, value):
+        self.items.append ((key, value))
+
+    def Merge (self, key, operand, operator):
+        """Merge operand into value of the key (see BPTree.Merge)"""
+        self.items.append ((key, operand, MergeOperator (operator)))
+
+    def __len__ (self):
+        return len (self.items)
+
+    #--------------------------------------------------------------------------#
+    # Commit                                                                   #
+    #--------------------------------------------------------------------------#
+    def Commit (self):
+        """Apply batched items to the table
+
+        Current values of merged keys are fetched with a single GetMany call,
+        operations are applied in order they were added to the batch.
+
+        returns: number of added (not updated) items
+        """
+        items, self.items = self.items, []
+
+        keys = [item [0] for item in items if len (item) > 2]
+        if keys:
+            values = dict (zip (keys, self.table.GetMany (keys)))
+            for position, item in enumerate (items):
+                if len (item) > 2:
+                    key, operand, merge = item
+                    item = key, merge (values [key], operand)
+                    items [position] = item
+                values [item [0]] = item [1]
+
+        return self.table.AddMany (items)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        if et is None:
+            self.Commit ()
+        return False
+
 #------------------------------------------------------------------------------#
 # Micro Database                                                               #
 #------------------------------------------------------------------------------#
 class uDB (Table):
     def __init__ (self, file, mode = 'r', cell = None, order = None, capacity_order = None,
-        type = None, flags = None):
+        type = None, flags = None, cache_size = None, codec = None, overflow = None, bloom = None):
 
         # init defaults
         capacity_order = default_sack_order if capacity_order is None else capacity_order
@@ -71,7 +270,7 @@ class uDB (Table):
         self.sack = FileSack (file, mode, capacity_order)
 
         # base ctor
-        Table.__init__ (self, self.sack, cell, order, type, flags)
+        Table.__init__ (self, self.sack, cell, order, type, flags, cache_size, codec, overflow, bloom)
 
     #--------------------------------------------------------------------------#
     # Dispose                                                                  #
@@ -89,8 +288,9 @@ class uDB (Table):
 # Multitable Database                                                          #
 #------------------------------------------------------------------------------#
 class xDB (object):
-    def __init__ (self, file, mode = 'r', capacity_order = None):
+    def __init__ (self, file, mode = 'r', capacity_order = None, cache_size = None):
         self.tables = {}
+        self.cache_size = cache_size
         self.sack = FileSack (file, mode, default_sack_order if capacity_order is None else capacity_order)
 
     #--------------------------------------------------------------------------#
@@ -103,10 +303,12 @@ class xDB (object):
     #--------------------------------------------------------------------------#
     # Access                                                                   #
     #--------------------------------------------------------------------------#
-    def Table (self, cell, order = None, type = None, flags = None):
+    def Table (self, cell, order = None, type = None, flags = None, cache_size = None, codec = None,
+        overflow = None, bloom = None):
         table = self.tables.get (cell)
         if table is None:
-            table = Table (self.sack, cell, order, type, flags)
+            table = Table (self.sack, cell, order, type, flags,
+                self.cache_size if cache_size is None else cache_size, codec, overflow, bloom)
             self.tables [cell] = table
         return table
 
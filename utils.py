@@ -3,7 +3,8 @@ import sys
 import array
 import struct
 
-__all__ = ('BytesList', 'ArraySave', 'ArrayLoad')
+__all__ = ('BytesList', 'BytesPack', 'BytesPrefixSize', 'BytesPrefixSave', 'BytesPrefixLoad', 'BytesPrefixUnpack',
+    'ArraySave', 'ArrayLoad', 'ArrayUnpack', 'ArrayUInt64')
 #------------------------------------------------------------------------------#
 # Bytes List                                                                   #
 #------------------------------------------------------------------------------#
@@ -31,9 +32,269 @@ class BytesList (list):
         sizes = ArrayLoad (stream, 'i', cls.count_header.unpack (stream.read (cls.count_header.size)) [0])
         return cls ((stream.read (size) if size >= 0 else None) for size in sizes)
 
+#------------------------------------------------------------------------------#
+# Bytes Pack                                                                   #
+#------------------------------------------------------------------------------#
+class BytesPack (object):
+    """Packed list of bytes
+
+    All items are stored in a single buffer and located by an offsets array,
+    so there is no per item object overhead. Buffer might be shared (serialized
+    BytesList inside bytes or mmap) and slices share buffer and offsets with
+    the sliced pack, so the first offset is not necessarily zero. Modification
+    unpacks items into a list, which is packed back on Save. Serialized format
+    is the same as BytesList's.
+    """
+    __slots__ = ('buffer', 'base', 'offsets', 'nones', 'items',)
+    count_header = BytesList.count_header
+    size_itemsize = array.array ('i').itemsize
+
+    def __init__ (self, items = tuple ()):
+        self.items = None
+        self.pack (items)
+
+    #--------------------------------------------------------------------------#
+    # Access                                                                   #
+    #--------------------------------------------------------------------------#
+    def __len__ (self):
+        if self.items is not None:
+            return len (self.items)
+        return len (self.offsets) - 1
+
+    def __getitem__ (self, index):
+        offsets = self.offsets
+        if offsets is not None and self.nones is None and index.__class__ is int and index >= 0:
+            # fast path (used by bisect)
+            base = self.base
+            return self.buffer [base + offsets [index]:base + offsets [index + 1]]
+
+        if isinstance (index, slice):
+            return BytesPack (self.items [index]) if self.items is not None else self.slice (index)
+        if self.items is not None:
+            return self.items [index]
+        if index < 0:
+            index += len (self.offsets) - 1
+            if index < 0:
+                raise IndexError ('pack index out of range')
+        if self.nones is not None and self.nones [index]:
+            return None
+        offsets, base = self.offsets, self.base
+        return self.buffer [base + offsets [index]:base + offsets [index + 1]]
+
+    def __iter__ (self):
+        if self.items is not None:
+            return iter (self.items)
+        return (self [index] for index in range (len (self.offsets) - 1))
+
+    def __repr__ (self):
+        return 'BytesPack({})'.format (list (self))
+
+    #--------------------------------------------------------------------------#
+    # Modify                                                                   #
+    #--------------------------------------------------------------------------#
+    def __setitem__ (self, index, item):
+        self.unpack () [index] = item
+
+    def __delitem__ (self, index):
+        del self.unpack () [index]
+
+    def insert (self, index, item):
+        self.unpack ().insert (index, item)
+
+    def append (self, item):
+        self.unpack ().append (item)
+
+    def extend (self, items):
+        self.unpack ().extend (items)
+
+    def pop (self, index = -1):
+        return self.unpack ().pop (index)
+
+    #--------------------------------------------------------------------------#
+    # Save | Load                                                              #
+    #--------------------------------------------------------------------------#
+    def Save (self, stream):
+        """Save pack
+
+        Saved pack owns its buffer, as shared buffer (mmap) might be reused
+        once pack's owner is relocated.
+        """
+        if self.items is not None:
+            self.pack (self.items)
+
+        offsets, nones = self.offsets, self.nones
+        stream.write (self.count_header.pack (len (self)))
+        ArraySave (stream, array.array ('i', ((-1 if nones is not None and nones [index] else
+            offsets [index + 1] - offsets [index]) for index in range (len (self)))))
+        self.buffer, self.base = self.buffer [self.base + offsets [0]:self.base + offsets [-1]], -offsets [0]
+        stream.write (self.buffer)
+
+    @classmethod
+    def Load (cls, stream):
+        pack = cls.__new__ (cls)
+        pack.sizes_init (ArrayLoad (stream, 'i', cls.count_header.unpack (stream.read (cls.count_header.size)) [0]))
+        pack.buffer, pack.base, pack.items = stream.read (pack.offsets [-1]), 0, None
+        return pack
+
+    @classmethod
+    def View (cls, buffer, offset):
+        """Create pack over serialized BytesList inside buffer without copying it
+
+        returns: (pack, end offset of serialized data)
+        """
+        count = cls.count_header.unpack_from (buffer, offset) [0]
+        items_offset = offset + cls.count_header.size + cls.size_itemsize * count
+
+        pack = cls.__new__ (cls)
+        pack.sizes_init (ArrayUnpack ('i', buffer [offset + cls.count_header.size:items_offset]))
+        pack.buffer, pack.base, pack.items = buffer, items_offset, None
+        return pack, items_offset + pack.offsets [-1]
+
+    #--------------------------------------------------------------------------#
+    # Private                                                                  #
+    #--------------------------------------------------------------------------#
+    def pack (self, items):
+        """Pack items into a single buffer"""
+        buffer, offsets, nones, offset = [], array.array ('I', (0,)), None, 0
+        for index, item in enumerate (items):
+            if item is None:
+                if nones is None:
+                    nones = array.array ('b', (0,) * index)
+                nones.append (1)
+            else:
+                buffer.append (item)
+                offset += len (item)
+                if nones is not None:
+                    nones.append (0)
+            offsets.append (offset)
+
+        self.buffer, self.base, self.offsets, self.nones = b''.join (buffer), 0, offsets, nones
+        self.items = None
+
+    def unpack (self):
+        """Unpack items into a list"""
+        if self.items is None:
+            buffer, base, offsets = self.buffer, self.base, self.offsets
+            items = [buffer [base + start:base + end] for start, end in zip (offsets, offsets [1:])]
+            if self.nones is not None:
+                for index, none in enumerate (self.nones):
+                    if none:
+                        items [index] = None
+            self.items = items
+            self.buffer = self.offsets = self.nones = None
+        return self.items
+
+    def slice (self, index):
+        begin, end, step = index.indices (len (self))
+        if step != 1:
+            return BytesPack (self [index] for index in range (begin, end, step))
+        end = max (begin, end)
+
+        pack, buffer, base, offsets = BytesPack.__new__ (BytesPack), self.buffer, self.base, self.offsets
+        if buffer.__class__ is not bytes:
+            # mapped buffer might be reused, copy sliced items out of it
+            buffer, base = buffer [base + offsets [begin]:base + offsets [end]], -offsets [begin]
+        pack.buffer, pack.base, pack.items = buffer, base, None
+        pack.offsets = offsets [begin:end + 1]
+        pack.nones = None if self.nones is None else self.nones [begin:end]
+        return pack
+
+    def sizes_init (self, sizes):
+        """Initialize offsets from serialized sizes"""
+        offsets, nones, offset = array.array ('I', (0,)), None, 0
+        for index, size in enumerate (sizes):
+            if size < 0:
+                if nones is None:
+                    nones = array.array ('b', (0,) * index)
+                nones.append (1)
+            else:
+                offset += size
+                if nones is not None:
+                    nones.append (0)
+            offsets.append (offset)
+        self.offsets, self.nones = offsets, nones
+
+#------------------------------------------------------------------------------#
+# Bytes Prefix (Save|Load)                                                     #
+#------------------------------------------------------------------------------#
+prefix_header = struct.Struct ('!I')
+prefix_itemsize = array.array ('i').itemsize
+
+def BytesPrefixSize (first, second):
+    """Size of common prefix of two bytes"""
+    # binary search (slices are compared natively)
+    size, limit = 0, min (len (first), len (second))
+    while size < limit:
+        middle = (size + limit + 1) >> 1
+        if first [:middle] == second [:middle]:
+            size = middle
+        else:
+            limit = middle - 1
+    return size
+
+def BytesPrefixSave (stream, items):
+    r"""Save sorted bytes with front coding
+
+    Each item is stored as the length of the prefix it shares with the
+    previous item and the rest of it.
+
+    Dump Structure:
+        0       4                      + (4 * count)  + (4 * count)    ?
+        +-------+----------------------+-------------+---------------+
+        | count | shared prefix sizes  | tail sizes  | tails         |
+        +-------+----------------------+-------------+---------------+
+    """
+    shared, sizes, tails, prev = array.array ('i'), array.array ('i'), [], b''
+    for item in items:
+        size = BytesPrefixSize (prev, item)
+        shared.append (size)
+        sizes.append (len (item) - size)
+        tails.append (item [size:])
+        prev = item
+
+    stream.write (prefix_header.pack (len (shared)))
+    ArraySave (stream, shared)
+    ArraySave (stream, sizes)
+    stream.write (b''.join (tails))
+
+def BytesPrefixLoad (stream):
+    """Load items saved with BytesPrefixSave
+
+    returns: list of items
+    """
+    count = prefix_header.unpack (stream.read (prefix_header.size)) [0]
+    shared, sizes = ArrayLoad (stream, 'i', count), ArrayLoad (stream, 'i', count)
+    return bytes_prefix_decode (shared, sizes, stream.read (sum (sizes)), 0)
+
+def BytesPrefixUnpack (buffer, offset):
+    """Load items saved with BytesPrefixSave from buffer
+
+    returns: (list of items, end offset of serialized data)
+    """
+    count = prefix_header.unpack_from (buffer, offset) [0]
+    offset += prefix_header.size
+    shared = ArrayUnpack ('i', buffer [offset:offset + prefix_itemsize * count])
+    offset += prefix_itemsize * count
+    sizes = ArrayUnpack ('i', buffer [offset:offset + prefix_itemsize * count])
+    offset += prefix_itemsize * count
+    end = offset + sum (sizes)
+    return bytes_prefix_decode (shared, sizes, buffer, offset), end
+
+def bytes_prefix_decode (shared, sizes, buffer, offset):
+    items, item = [], b''
+    for shared_size, size in zip (shared, sizes):
+        item = item [:shared_size] + buffer [offset:offset + size]
+        offset += size
+        items.append (item)
+    return items
+
 #------------------------------------------------------------------------------#
 # Array (Save|Load)                                                            #
 #------------------------------------------------------------------------------#
+# unsigned 64-bit array type ('Q' is not supported by Python 2, where unsigned
+# long is 64-bit on LP64 platforms)
+ArrayUInt64 = 'Q' if sys.version_info [0] >= 3 else 'L'
+
 if sys.version_info [0] < 3:
 # Python 2
     def ArraySave (stream, array):
@@ -43,6 +304,11 @@ if sys.version_info [0] < 3:
         sizes = array.array (type)
         sizes.fromstring (stream.read (sizes.itemsize * count))
         return sizes
+
+    def ArrayUnpack (type, data):
+        items = array.array (type)
+        items.fromstring (bytes (data))
+        return items
 else:
     def ArraySave (stream, array):
         array.tofile (stream)
@@ -51,4 +317,9 @@ else:
         sizes = array.array (type)
         sizes.fromfile (stream, count)
         return sizes
+
+    def ArrayUnpack (type, data):
+        items = array.array (type)
+        items.frombytes (data)
+        return items
 # vim: nu ft=python columns=120 :